@@ -1,4 +1,11 @@
+import mmap
 import os
+import re
+import sys
+import time
+from array import array
+
+from debugmap import write_debug_map
 
 
 A_COMMAND = 0
@@ -6,155 +13,500 @@ C_COMMAND = 1
 L_COMMAND = 2
 
 
+# Mnemonic tables, indexed by the small integer ids stored in the IR
+# Dest and jump ids coincide with their 3 bit binary codes
+COMP_MNEMONICS = ("0", "1", "-1", "D", "A", "!D", "!A", "-D", "-A", "D+1", "A+1",
+                  "D-1", "A-1", "D+A", "D-A", "A-D", "D&A", "D|A",
+                  "M", "!M", "-M", "M+1", "M-1", "D+M", "D-M", "M-D", "D&M", "D|M")
+DEST_MNEMONICS = (None, "M", "D", "MD", "A", "AM", "AD", "AMD")
+JUMP_MNEMONICS = (None, "JGT", "JEQ", "JGE", "JLT", "JNE", "JLE", "JMP")
+
+# Commutative spellings accepted for the canonical comp mnemonics; the
+# VM translators emit M=M+D
+COMP_ALIASES = {"A+D": "D+A", "A&D": "D&A", "A|D": "D|A",
+                "M+D": "D+M", "M&D": "D&M", "M|D": "D|M"}
+COMP_IDS = {code: i for i, code in enumerate(COMP_MNEMONICS)}
+COMP_IDS.update((alias, COMP_IDS[code]) for alias, code in COMP_ALIASES.items())
+DEST_IDS = {code: i for i, code in enumerate(DEST_MNEMONICS)}
+JUMP_IDS = {code: i for i, code in enumerate(JUMP_MNEMONICS)}
+
+# Everything from // to the end of its line
+COMMENT_RE = re.compile(r"//[^\n]*")
+
+
 class Assembler:
 
-    def __init__(self, asm_file):
+    def __init__(self, asm_file, streaming=False, coder=None):
+        # A Coder can be passed in to share its tables between assemblies
         self.asm_file = asm_file
-        self.hack_file = asm_file.split(".")[0] + ".hack"
-        self.parser = Parser(self.asm_file)
-        self.coder = Coder()
+        base_name = os.path.splitext(asm_file)[0]
+        self.hack_file = base_name + ".hack"
+        self.rom_file = base_name + ".rom"
+        self.dbg_file = base_name + ".dbg"
+        self.streaming = streaming
+        if streaming:
+            self.parser = StreamParser(self.asm_file)
+        else:
+            self.parser = Parser(self.asm_file)
+        self.coder = coder if coder is not None else Coder()
         self.ST = SymbolTable()
         self.next_RAM_address = 16
+        self.ir = None
+        self.words = None
+        self.variables = []
+        self.optimizer = None
 
-    def assemble(self):
+    def assemble(self, single_pass=False, rom=False, debug=False, optimize=False):
         # Main assembly function
-        self.parser.preprocess()
-        self.first_pass()
-        self.second_pass()
+        # With rom=True a packed binary image is written next to the .hack file
+        # With debug=True a .dbg map from ROM addresses to source is written too
+        # With optimize=True redundant instructions are removed first
+        # Streaming is always single pass and supports neither debug nor optimize
+        if self.streaming:
+            if debug:
+                raise ValueError("Debug maps are not supported when streaming")
+            if optimize:
+                raise ValueError("The peephole optimizer is not supported when streaming")
+            self.stream_pass(rom)
+            return
+        self.parser.preprocess(track_lines=debug)
+        self.ir = self.parser.parse()
+        if optimize:
+            self.optimize()
+        if single_pass:
+            self.single_pass()
+        else:
+            self.first_pass()
+            self.second_pass()
+        self.write_output(rom)
+        if debug:
+            self.write_debug_map()
+
+    def optimize(self):
+        # Run the peephole optimizer over the parsed program
+        self.optimizer = PeepholeOptimizer()
+        self.ir, origins = self.optimizer.optimize(self.ir)
+        line_numbers = self.parser.line_numbers
+        if line_numbers is not None:
+            self.parser.line_numbers = array('I', [line_numbers[i] for i in origins])
+        return self.optimizer.saved()
+
+    def resolve(self, symbol):
+        # Address of an A instruction symbol, allocating variables on first use
+        if symbol.isnumeric():
+            return int(symbol)
+        if not self.ST.contains(symbol):
+            self.ST.addEntry(symbol, self.next_RAM_address)
+            self.variables.append((symbol, self.next_RAM_address))
+            self.next_RAM_address += 1
+        return self.ST.getAddress(symbol)
 
     def first_pass(self):
         # Construct symbol table for L_COMMAND's
         self.ROM_address = 0
-        while self.parser.hasMoreCommands():
-            self.parser.advance()
-            if self.parser.commandType() == L_COMMAND:
-                symbol = self.parser.symbol()
-                self.ST.addEntry(symbol, self.ROM_address)
+        kinds = self.ir.kinds
+        symbols = self.ir.symbols
+        names = self.ir.symbol_names
+        for i in range(len(kinds)):
+            if kinds[i] == L_COMMAND:
+                self.ST.addLabel(names[symbols[i]], self.ROM_address)
             else:
                 self.ROM_address += 1
-        self.parser.reset()
+
+    def single_pass(self):
+        # Generate code in one scan, backpatching forward references
+        # An unknown symbol is either a label defined further down or a
+        # variable, which can only be told apart once every label is seen
+        ir = self.ir
+        names = ir.symbol_names
+        words = array('H')
+        fixup_addresses = array('l')
+        fixup_symbols = array('l')
+        self.ROM_address = 0
+        for i in range(len(ir.kinds)):
+            kind = ir.kinds[i]
+            if kind == L_COMMAND:
+                self.ST.addLabel(names[ir.symbols[i]], self.ROM_address)
+                continue
+            if kind == A_COMMAND:
+                symbol = names[ir.symbols[i]]
+                if symbol.isnumeric() or self.ST.contains(symbol):
+                    words.append(self.coder.encodeA(self.resolve(symbol)))
+                else:
+                    fixup_addresses.append(self.ROM_address)
+                    fixup_symbols.append(ir.symbols[i])
+                    words.append(0)
+            else:
+                words.append(self.coder.encodeC(ir.comps[i], ir.dests[i], ir.jumps[i]))
+            self.ROM_address += 1
+        # Patch pending references in order of first use, so variables are
+        # allocated RAM addresses exactly as second_pass would allocate them
+        for ROM_address, symbol_id in zip(fixup_addresses, fixup_symbols):
+            words[ROM_address] = self.coder.encodeA(self.resolve(names[symbol_id]))
+        self.words = words
 
     def second_pass(self):
         # Generate code
-        out_file = open(self.hack_file, "wt")
-        while self.parser.hasMoreCommands():
-            self.parser.advance()
-            if self.parser.commandType() == A_COMMAND:
+        ir = self.ir
+        names = ir.symbol_names
+        encodeA = self.coder.encodeA
+        encodeC = self.coder.encodeC
+        # Each symbol is resolved once, the first time it is referenced
+        resolved = array('l', [-1]) * len(names)
+        words = array('H')
+        for i in range(len(ir.kinds)):
+            kind = ir.kinds[i]
+            if kind == A_COMMAND:
                 # A instruction code generation
-                abin = "0"
-                symbol = self.parser.symbol()
-                if symbol.isnumeric():
-                    symbol_int = int(symbol)
-                elif self.ST.contains(symbol):
-                    symbol_int = self.ST.getAddress(symbol)
-                else:
-                    self.ST.addEntry(symbol, self.next_RAM_address)
-                    self.next_RAM_address += 1
-                    symbol_int = self.ST.getAddress(symbol)
-                abin += bin(symbol_int)[2:].zfill(15)
-                out_file.write(abin + "\n")
-            elif self.parser.commandType() == C_COMMAND:
+                symbol_id = ir.symbols[i]
+                symbol_int = resolved[symbol_id]
+                if symbol_int < 0:
+                    symbol_int = encodeA(self.resolve(names[symbol_id]))
+                    resolved[symbol_id] = symbol_int
+                words.append(symbol_int)
+            elif kind == C_COMMAND:
                 # C instruction code generation
-                cbin = "111"
-                cbin += self.coder.comp(self.parser.comp())
-                cbin += self.coder.dest(self.parser.dest())
-                cbin += self.coder.jump(self.parser.jump())
-                out_file.write(cbin + "\n")
-        out_file.close()
+                words.append(encodeC(ir.comps[i], ir.dests[i], ir.jumps[i]))
+        self.words = words
+
+    def stream_pass(self, rom=False, buffer_words=65536):
+        # Single pass over a memory mapped source, writing output as it goes
+        # Only the symbol table and the pending fixups stay in memory; the
+        # fixups are patched in place once every label has been seen
+        linesep = os.linesep.encode()
+        line_width = 16 + len(linesep)
+        hack_out = open(self.hack_file, "wb")
+        rom_out = open(self.rom_file, "wb") if rom else None
+        words = array('H')
+        c_words = {}
+        fixup_addresses = array('l')
+        fixup_symbols = array('l')
+        fixup_ids = {}
+        fixup_names = []
+        self.ROM_address = 0
+        for cmd in self.parser.commands():
+            if cmd[0] == '@':
+                symbol = cmd[1:]
+                if symbol.isnumeric() or self.ST.contains(symbol):
+                    words.append(self.coder.encodeA(self.resolve(symbol)))
+                else:
+                    symbol_id = fixup_ids.get(symbol)
+                    if symbol_id is None:
+                        symbol_id = fixup_ids[symbol] = len(fixup_names)
+                        fixup_names.append(symbol)
+                    fixup_addresses.append(self.ROM_address)
+                    fixup_symbols.append(symbol_id)
+                    words.append(0)
+            elif cmd[0] == '(' and cmd[-1] == ')':
+                self.ST.addLabel(cmd[1:-1], self.ROM_address)
+                continue
+            else:
+                word = c_words.get(cmd)
+                if word is None:
+                    word = c_words[cmd] = self.coder.encodeC(*Parser.instructionFields(cmd))
+                words.append(word)
+            self.ROM_address += 1
+            if len(words) >= buffer_words:
+                self.stream_words(words, hack_out, rom_out, linesep)
+                del words[:]
+        self.stream_words(words, hack_out, rom_out, linesep)
+        # Patch pending references in order of first use, so variables are
+        # allocated RAM addresses exactly as second_pass would allocate them
+        resolved = array('l', [-1]) * len(fixup_names)
+        for ROM_address, symbol_id in zip(fixup_addresses, fixup_symbols):
+            word = resolved[symbol_id]
+            if word < 0:
+                word = resolved[symbol_id] = self.coder.encodeA(self.resolve(fixup_names[symbol_id]))
+            hack_out.seek(ROM_address * line_width)
+            hack_out.write(format(word, "016b").encode())
+            if rom_out is not None:
+                rom_out.seek(ROM_address * 2)
+                rom_out.write(word.to_bytes(2, "little"))
+        hack_out.close()
+        if rom_out is not None:
+            rom_out.close()
+
+    def write_debug_map(self):
+        # Map each ROM address to its source line and enclosing label
+        write_debug_map(self.dbg_file, self.locations(), self.variables)
+
+    def locations(self):
+        # (source line, enclosing label) of each instruction in ROM order
+        ir = self.ir
+        line_numbers = self.parser.line_numbers
+        label = None
+        for i in range(len(ir)):
+            if ir.kinds[i] == L_COMMAND:
+                label = ir.symbol_names[ir.symbols[i]]
+            else:
+                yield line_numbers[i], label
 
+    @staticmethod
+    def stream_words(words, hack_out, rom_out, linesep):
+        # Append a buffer of encoded words to the open output files
+        if not words:
+            return
+        hack_out.write(linesep.join([format(word, "016b").encode() for word in words]) + linesep)
+        if rom_out is not None:
+            rom = array('H', words)
+            if sys.byteorder != "little":
+                rom.byteswap()
+            rom.tofile(rom_out)
+
+    def write_output(self, rom=False):
+        # Write the encoded words as text, and optionally as a binary image
+        self.coder.writeHack(self.words, self.hack_file)
+        if rom:
+            self.coder.writeRom(self.words, self.rom_file)
+
+
+class InstructionIR:
+
+    # Parsed program as parallel typed arrays, one entry per command
+    # A and L commands refer to interned symbol names by id; C commands
+    # store comp/dest/jump ids into the mnemonic tables
 
-class Parser:
+    def __init__(self):
+        self.kinds = array('B')
+        self.symbols = array('l')
+        self.comps = array('B')
+        self.dests = array('B')
+        self.jumps = array('B')
+        self.symbol_names = []
+        self.symbol_ids = {}
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def symbolId(self, symbol):
+        # Intern a symbol name
+        symbol_id = self.symbol_ids.get(symbol)
+        if symbol_id is None:
+            symbol_id = len(self.symbol_names)
+            self.symbol_ids[symbol] = symbol_id
+            self.symbol_names.append(symbol)
+        return symbol_id
+
+    def append(self, kind, symbol=-1, comp=0, dest=0, jump=0):
+        self.kinds.append(kind)
+        self.symbols.append(symbol)
+        self.comps.append(comp)
+        self.dests.append(dest)
+        self.jumps.append(jump)
+
+
+class PeepholeOptimizer:
+
+    # Removes provably redundant instructions from the IR before ROM
+    # addresses are assigned. Windows never extend across a label, since
+    # a label may be reached from anywhere; jumps are assumed to target
+    # labels, not numeric ROM addresses
+    #
+    # Rules:
+    #   reload    @x when A already holds x
+    #   dead_load @x immediately overwritten by another A instruction
+    #   inverse   M=M+1 directly followed by M=M-1 (or the reverse), and
+    #             the same for D
+    #   d_copy    D=A, D=M or M=D when D already equals that register;
+    #             memory is only assumed stable while A holds a known
+    #             symbol other than KBD, since the keyboard can change
+    #             between two reads and a computed A may point at it
+
+    def __init__(self):
+        self.removed = {"reload": 0, "dead_load": 0, "inverse": 0, "d_copy": 0}
+        self.inverse_pairs = {}
+        for dest, up, down in ((1, "M+1", "M-1"), (2, "D+1", "D-1")):
+            self.inverse_pairs[(dest, COMP_IDS[up])] = (dest, COMP_IDS[down])
+            self.inverse_pairs[(dest, COMP_IDS[down])] = (dest, COMP_IDS[up])
+        self.comp_A = COMP_IDS["A"]
+        self.comp_D = COMP_IDS["D"]
+        self.comp_M = COMP_IDS["M"]
+
+    def saved(self):
+        # ROM words saved by the last optimize
+        return sum(self.removed.values())
+
+    def optimize(self, ir):
+        # Return the optimized IR and, for each of its entries, the index
+        # of the entry it came from in ir
+        out = InstructionIR()
+        out.symbol_names = ir.symbol_names
+        out.symbol_ids = ir.symbol_ids
+        origins = array('I')
+        # a_symbol: symbol id A is known to hold
+        # d_source: "A" or "M" when D is known to equal that register
+        keyboard = {ir.symbol_ids.get(name) for name in ("KBD", "24576")} - {None}
+        a_symbol = None
+        d_source = None
+        for i in range(len(ir)):
+            kind = ir.kinds[i]
+            if kind == L_COMMAND:
+                a_symbol = None
+                d_source = None
+            elif kind == A_COMMAND:
+                symbol = ir.symbols[i]
+                if symbol == a_symbol:
+                    self.removed["reload"] += 1
+                    continue
+                if len(out) and out.kinds[-1] == A_COMMAND:
+                    self.pop(out, origins)
+                    self.removed["dead_load"] += 1
+                a_symbol = symbol
+                d_source = None
+            else:
+                comp, dest, jump = ir.comps[i], ir.dests[i], ir.jumps[i]
+                if jump == 0:
+                    if d_source == "A" and dest == 2 and comp == self.comp_A or \
+                       d_source == "M" and (dest == 2 and comp == self.comp_M or dest == 1 and comp == self.comp_D):
+                        self.removed["d_copy"] += 1
+                        continue
+                    if len(out) and out.kinds[-1] == C_COMMAND and out.jumps[-1] == 0 and \
+                       self.inverse_pairs.get((out.dests[-1], out.comps[-1])) == (dest, comp):
+                        self.pop(out, origins)
+                        self.removed["inverse"] += 2
+                        continue
+                d_source = self.dSource(d_source, comp, dest)
+                if d_source == "M" and (a_symbol is None or a_symbol in keyboard):
+                    d_source = None
+                if dest & 4:
+                    a_symbol = None
+            out.append(kind, ir.symbols[i], ir.comps[i], ir.dests[i], ir.jumps[i])
+            origins.append(i)
+        return out, origins
+
+    def dSource(self, d_source, comp, dest):
+        # What D is known to equal after a C instruction
+        writes_A, writes_D, writes_M = dest & 4, dest & 2, dest & 1
+        if writes_A:
+            return None
+        if writes_D:
+            if writes_M:
+                return "M"
+            if comp == self.comp_A:
+                return "A"
+            if comp == self.comp_M:
+                return "M"
+            return None
+        if writes_M:
+            return "M" if comp == self.comp_D else None
+        return d_source
+
+    @staticmethod
+    def pop(ir, origins):
+        # Drop the last entry of an IR under construction
+        for table in (ir.kinds, ir.symbols, ir.comps, ir.dests, ir.jumps, origins):
+            table.pop()
+
+
+class StreamParser:
+
+    # Reads commands straight from a memory map of the source file, so no
+    # list of lines is ever held in memory
 
     def __init__(self, asm_file):
-        file_handle = open(asm_file, 'rt')
-        self.file_lines = file_handle.readlines()
-        self.num_lines = len(self.file_lines)
-        self.line_index = -1
+        self.asm_file = asm_file
 
-    def reset(self):
-        self.line_index = -1
+    def commands(self):
+        # Yield each nontrivial command, comments and whitespace removed
+        file_handle = open(self.asm_file, 'rb')
+        try:
+            source = mmap.mmap(file_handle.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # Empty files cannot be mapped
+            source = file_handle
+        try:
+            for line in iter(source.readline, b""):
+                line = Parser.strip_whitespace(line.split(b"//", 1)[0].decode())
+                if line:
+                    yield line
+        finally:
+            source.close()
+            file_handle.close()
 
-    def currentCommand(self):
-        return self.file_lines[self.line_index]
 
-    def hasMoreCommands(self):
-        # Determine if any more nontrivial commands
-        if self.line_index < self.num_lines - 1:
-            return True
-        else:
-            return False
-
-    def advance(self):
-        # Advance parser to next line
-        self.line_index += 1
-
-    def commandType(self):
-        # Determine type of command
-        cmd = self.currentCommand()
-        if cmd[0] == '@':
-            return A_COMMAND
-        elif cmd[0] == '(' and cmd[-1] == ')':
-            return L_COMMAND
-        else:
-            return C_COMMAND
-
-    def symbol(self):
-        # Extract symbol in command
-        cmd = self.currentCommand()
-        if self.commandType() == A_COMMAND:
-            return cmd[1:]
-        elif self.commandType() == L_COMMAND:
-            return cmd[1:-1]
-
-    def dest(self):
-        cmd = self.currentCommand()
-        if "=" in cmd:
-            return cmd.split("=")[0]
-        else:
-            return None
+class Parser:
+
+    def __init__(self, asm_file):
+        # Commands are only available once the source is preprocessed
+        file_handle = open(asm_file, 'rt')
+        self.source = file_handle.read()
+        file_handle.close()
+        self.file_lines = []
+        self.source_lines = 0
+        self.preprocess_time = 0.0
+        self.line_numbers = None
+
+    def parse(self):
+        # Parse every command once into the compact instruction IR; the
+        # command strings are dropped, as nothing reads them afterwards
+        ir = self.parseCommands(self.file_lines)
+        self.file_lines = None
+        return ir
+
+    @classmethod
+    def parseCommands(cls, commands):
+        # Build the IR from preprocessed command strings
+        ir = InstructionIR()
+        c_fields = {}
+        for cmd in commands:
+            if cmd[0] == '@':
+                ir.append(A_COMMAND, ir.symbolId(cmd[1:]))
+            elif cmd[0] == '(' and cmd[-1] == ')':
+                ir.append(L_COMMAND, ir.symbolId(cmd[1:-1]))
+            else:
+                # Generated code repeats a small set of C instructions
+                fields = c_fields.get(cmd)
+                if fields is None:
+                    fields = cls.instructionFields(cmd)
+                    c_fields[cmd] = fields
+                ir.append(C_COMMAND, -1, *fields)
+        return ir
+
+    @classmethod
+    def instructionFields(cls, cmd):
+        # IR comp, dest and jump ids of a C instruction
+        comp, dest, jump = cls.splitInstruction(cmd)
+        return COMP_IDS[comp], DEST_IDS.get(dest, 0), JUMP_IDS.get(jump, 0)
 
-    def comp(self):
-        cmd = self.currentCommand()
+    @staticmethod
+    def splitInstruction(cmd):
+        # Split a C instruction into its comp, dest and jump mnemonics
+        dest = None
+        jump = None
+        comp = cmd
         if "=" in cmd:
-            cmd = cmd.split("=")[-1]
+            dest = cmd.split("=")[0]
+            comp = cmd.split("=")[-1]
+        if ";" in comp:
+            comp = comp.split(";")[0]
         if ";" in cmd:
-            cmd = cmd.split(";")[0]
-        return cmd
-    
-    def jump(self):
-        cmd = self.currentCommand()
-        if ";" in cmd:
-            return cmd.split(";")[-1]
-        else:
-            return None
+            jump = cmd.split(";")[-1]
+        return comp, dest, jump
 
-    def preprocess(self):
+    def preprocess(self, track_lines=False):
         # Remove comments and whitespace
-        new_lines = []
-        for i, line in enumerate(self.file_lines):
-            line = self.strip_comments(line)
-            line = self.strip_whitespace(line)
-            if len(line) != 0:
-                new_lines.append(line)
-        self.file_lines = new_lines
-        self.num_lines = len(self.file_lines)
+        # Works on the whole source at once: comments are cut by a single
+        # regex substitution and the lines are stripped in C
+        # With track_lines=True the 1-based source line of each command is
+        # kept in line_numbers
+        start = time.perf_counter()
+        text = COMMENT_RE.sub("", self.source)
+        self.source = None
+        lines = text.split("\n")
+        self.source_lines = len(lines)
+        if track_lines:
+            lines = list(map(str.strip, lines))
+            self.line_numbers = array('I', [i + 1 for i, line in enumerate(lines) if line])
+            self.file_lines = [line for line in lines if line]
+        else:
+            self.file_lines = [line for line in map(str.strip, lines) if line]
+        self.preprocess_time = time.perf_counter() - start
 
-    @staticmethod
-    def strip_comments(line):
-        # Strip all trailing characters following //
-        stripped = ''
-        prev_ch = ''
-        next_ch = ''
-        for next_ch in line:
-            if next_ch == '/':
-                if prev_ch == '/':
-                    break
-                else:
-                    stripped += prev_ch
-            else:
-                stripped += next_ch
-            prev_ch = next_ch
-        return stripped
+    def preprocessRate(self):
+        # Source lines handled per second by the last preprocess
+        if self.preprocess_time <= 0:
+            return float("inf")
+        return self.source_lines / self.preprocess_time
 
     @staticmethod
     def strip_whitespace(line):
@@ -169,9 +521,43 @@ class Coder:
                             "-D": "001111", "-A": "110011", "D+1": "011111", "A+1": "110111", 
                             "D-1": "001110", "A-1": "110010", "D+A": "000010", "D-A": "010011", 
                             "A-D": "000111", "D&A": "000000", "D|A": "010101"}
+        # Complete C instruction prefix for each IR comp id: 111 a cccccc
+        self.comp_words = array('H', [(0b111 << 13) | (int(self.comp(code), 2) << 6)
+                                      for code in COMP_MNEMONICS])
+
+    def encodeC(self, comp, dest, jump):
+        # C instruction word from IR comp, dest and jump ids
+        return self.comp_words[comp] | (dest << 3) | jump
+
+    @staticmethod
+    def encodeA(value):
+        # A instruction word
+        if not 0 <= value < 0x8000:
+            raise ValueError("Address {} does not fit in an A instruction".format(value))
+        return value
+
+    @staticmethod
+    def writeHack(words, hack_file, chunk_words=65536):
+        # Text .hack file, one 16 character binary word per line, written
+        # in chunks so no copy of the whole text is held in memory
+        out_file = open(hack_file, "wt")
+        for start in range(0, len(words), chunk_words):
+            out_file.write("".join([format(word, "016b") + "\n" for word in words[start:start + chunk_words]]))
+        out_file.close()
+
+    @staticmethod
+    def writeRom(words, rom_file):
+        # Packed little-endian uint16 image, suitable for mmap by loaders
+        rom = array('H', words)
+        if sys.byteorder != "little":
+            rom.byteswap()
+        out_file = open(rom_file, "wb")
+        rom.tofile(out_file)
+        out_file.close()
 
     def comp(self, code):
         # Computation binary code translation
+        code = COMP_ALIASES.get(code, code)
         if "M" in code:
             code = code.replace("M", "A")
             bin_code = "1"
@@ -229,6 +615,13 @@ class SymbolTable:
     def addEntry(self, symbol, address):
         self.ST[symbol] = address
 
+    def addLabel(self, symbol, address):
+        # Labels may not redefine another label or a predefined symbol:
+        # one-pass assembly would resolve earlier references differently
+        if self.contains(symbol):
+            raise ValueError("Label {} is already defined".format(symbol))
+        self.ST[symbol] = address
+
     def contains(self, symbol):
         return self.ST.get(symbol) is not None
 
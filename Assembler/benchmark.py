@@ -0,0 +1,141 @@
+import argparse
+import json
+import os
+import platform
+import random
+import tempfile
+import time
+import tracemalloc
+
+from assembler import *
+
+
+# C instructions drawn on by the generator
+C_SAMPLES = ("D=M", "D=A", "M=D", "M=M+1", "M=M-1", "AM=M-1", "A=M", "D=D+A",
+             "D=D-M", "MD=M+1", "D=!D", "M=-1", "M=0", "D;JEQ", "D;JGT", "0;JMP",
+             "D=D|M", "AD=D-1;JNE", "A=A+1", "D=M-D;JLT")
+
+
+def generate_program(asm_file, instructions, seed=0, a_ratio=0.5, label_every=16,
+                     num_variables=64, comment_ratio=0.1, blank_ratio=0.05):
+    # Write a synthetic Hack program with the given size and mix
+    # Labels fall every label_every instructions; A instructions refer to
+    # labels, variables, predefined symbols and constants. Only labels
+    # whose addresses fit in an A instruction are referenced
+    rng = random.Random(seed)
+    num_labels = max(1, instructions // label_every)
+    addressable_labels = max(1, min(num_labels, 0x7FFF // label_every))
+    predefined = ("SP", "LCL", "ARG", "THIS", "THAT", "R13", "R14", "R15", "SCREEN", "KBD")
+    out_file = open(asm_file, "wt")
+    for i in range(instructions):
+        if i % label_every == 0:
+            out_file.write("(L{})\n".format(i // label_every))
+        if rng.random() < a_ratio:
+            pick = rng.random()
+            if pick < 0.4:
+                cmd = "@L{}".format(rng.randrange(addressable_labels))
+            elif pick < 0.7:
+                cmd = "@v{}".format(rng.randrange(num_variables))
+            elif pick < 0.85:
+                cmd = "@" + rng.choice(predefined)
+            else:
+                cmd = "@{}".format(rng.randrange(0x8000))
+        else:
+            cmd = rng.choice(C_SAMPLES)
+        if rng.random() < comment_ratio:
+            cmd += "    // instruction {}".format(i)
+        out_file.write(cmd + "\n")
+        if rng.random() < comment_ratio:
+            out_file.write("// comment line\n")
+        if rng.random() < blank_ratio:
+            out_file.write("\n")
+    out_file.close()
+
+
+def time_phases(asm_file, mode):
+    # Assemble once, timing each phase
+    phases = {}
+    start = time.perf_counter()
+    asm = Assembler(asm_file, streaming=(mode == "streaming"))
+    phases["read"] = time.perf_counter() - start
+    if mode == "streaming":
+        start = time.perf_counter()
+        asm.stream_pass()
+        phases["stream_pass"] = time.perf_counter() - start
+        return phases, asm.ROM_address
+    start = time.perf_counter()
+    asm.parser.preprocess()
+    phases["preprocess"] = time.perf_counter() - start
+    start = time.perf_counter()
+    asm.ir = asm.parser.parse()
+    phases["parse"] = time.perf_counter() - start
+    if mode == "single_pass":
+        start = time.perf_counter()
+        asm.single_pass()
+        phases["single_pass"] = time.perf_counter() - start
+    else:
+        start = time.perf_counter()
+        asm.first_pass()
+        phases["first_pass"] = time.perf_counter() - start
+        start = time.perf_counter()
+        asm.second_pass()
+        phases["second_pass"] = time.perf_counter() - start
+    start = time.perf_counter()
+    asm.write_output()
+    phases["write"] = time.perf_counter() - start
+    return phases, len(asm.words)
+
+
+def peak_memory(asm_file, mode):
+    # Peak traced allocation of a full assembly, measured separately since
+    # tracing slows everything down
+    tracemalloc.start()
+    asm = Assembler(asm_file, streaming=(mode == "streaming"))
+    asm.assemble(single_pass=(mode == "single_pass"))
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak
+
+
+def run_benchmarks(sizes, modes, repeat, seed, work_dir):
+    results = []
+    for size in sizes:
+        asm_file = os.path.join(work_dir, "bench_{}.asm".format(size))
+        generate_program(asm_file, size, seed=seed)
+        for mode in modes:
+            best = None
+            for _ in range(repeat):
+                phases, instructions = time_phases(asm_file, mode)
+                if best is None or sum(phases.values()) < sum(best.values()):
+                    best = phases
+            total = sum(best.values())
+            results.append({"instructions": instructions,
+                            "source_bytes": os.path.getsize(asm_file),
+                            "mode": mode,
+                            "phases": best,
+                            "total_seconds": total,
+                            "instructions_per_second": instructions / total if total else None,
+                            "peak_memory_bytes": peak_memory(asm_file, mode)})
+            print("{:>9} instructions {:>12}: {:8.3f}s {:>12.0f} inst/s".format(
+                instructions, mode, total, instructions / total if total else 0))
+    return results
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description="Assembler throughput benchmarks")
+    arg_parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 30000])
+    arg_parser.add_argument("--modes", nargs="+", default=["two_pass", "single_pass", "streaming"],
+                            choices=["two_pass", "single_pass", "streaming"])
+    arg_parser.add_argument("--repeat", type=int, default=3)
+    arg_parser.add_argument("--seed", type=int, default=0)
+    arg_parser.add_argument("--output", default="assembler_benchmark.json")
+    args = arg_parser.parse_args()
+    with tempfile.TemporaryDirectory() as work_dir:
+        results = run_benchmarks(args.sizes, args.modes, args.repeat, args.seed, work_dir)
+    report = {"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+              "python": platform.python_version(),
+              "platform": platform.platform(),
+              "results": results}
+    out_file = open(args.output, "wt")
+    json.dump(report, out_file, indent=2)
+    out_file.close()
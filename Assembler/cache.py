@@ -0,0 +1,117 @@
+import hashlib
+import os
+import struct
+import sys
+import zlib
+
+from assembler import *
+from linker import OBJECT_VERSION, Linker, ObjectModule
+
+
+class AssemblyCache:
+
+    # Content-addressed on-disk cache of encoded code chunks
+    # The preprocessed source is cut into chunks at labels; each chunk is
+    # keyed by a hash of its text and stored as a relocatable object, so
+    # only changed chunks are re-encoded and the linker re-patches all
+    # label and variable addresses on top
+    # A chunk ends at a label only once it holds min_commands commands and
+    # the label's name hashes to a boundary (one label in four), so chunks
+    # stay large on label-dense code and, since cut points depend on the
+    # labels themselves, they fall back into place right after an edit
+
+    def __init__(self, cache_dir, max_bytes=64 * 1024 * 1024, min_commands=256):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.min_commands = min_commands
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def assemble(self, asm_file, rom=False):
+        # Assemble asm_file to its .hack (and .rom) file through the cache
+        parser = Parser(asm_file)
+        parser.preprocess()
+        modules = [self.chunkObject(chunk) for chunk in self.split(parser.file_lines)]
+        linker = Linker(modules)
+        words = linker.link()
+        base_name = os.path.splitext(asm_file)[0]
+        linker.coder.writeHack(words, base_name + ".hack")
+        if rom:
+            linker.coder.writeRom(words, base_name + ".rom")
+        self.evict()
+        return words
+
+    def split(self, commands):
+        # Cut commands into chunks, each after the first starting at a label
+        chunks = []
+        chunk = []
+        for cmd in commands:
+            if cmd[0] == '(' and len(chunk) >= self.min_commands and zlib.crc32(cmd.encode()) % 4 == 0:
+                chunks.append(chunk)
+                chunk = []
+            chunk.append(cmd)
+        if chunk:
+            chunks.append(chunk)
+        return chunks
+
+    def chunkObject(self, chunk):
+        # Load an encoded chunk from the cache, or encode and store it
+        text = "\n".join(chunk)
+        key = hashlib.sha1("{}\n{}".format(OBJECT_VERSION, text).encode()).hexdigest()
+        obj_file = os.path.join(self.cache_dir, key + ".hobj")
+        try:
+            # Touch on use so eviction drops the least recently used entries
+            os.utime(obj_file)
+            module = ObjectModule.load(obj_file, key)
+        except (OSError, struct.error, ValueError, RuntimeError):
+            # Missing (or evicted meanwhile), truncated or corrupt entries
+            # are misses and get overwritten below
+            pass
+        else:
+            self.hits += 1
+            return module
+        self.misses += 1
+        module = ObjectModule.fromCommands(chunk, key)
+        # save writes then renames, so concurrent builds never read a
+        # partial entry
+        module.save(obj_file)
+        return module
+
+    def evict(self):
+        # Drop least recently used entries until the cache fits in max_bytes
+        entries = []
+        total = 0
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith(".hobj"):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+        if total <= self.max_bytes:
+            return
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                # Already evicted by a concurrent build
+                pass
+            total -= size
+            self.evictions += 1
+
+    def stats(self):
+        # Hit statistics since this cache object was created
+        lookups = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0}
+
+
+if __name__ == '__main__':
+    assert(len(sys.argv) == 3)
+    asm_file = sys.argv[1]
+    cache = AssemblyCache(sys.argv[2])
+    cache.assemble(asm_file)
+    print(cache.stats())
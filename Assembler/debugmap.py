@@ -0,0 +1,149 @@
+import bisect
+import struct
+import sys
+from array import array
+
+
+# Debug map layout (little-endian):
+#   header: magic, version, ROM size, run count, variable count, name count,
+#   name bytes
+#   runs: (ROM address, source line, label name id) uint32 triples, sorted
+#   by ROM address; a run covers consecutive instructions on consecutive
+#   source lines under the same label
+#   variables: (RAM address, name id) uint32 pairs, sorted by RAM address
+#   names: offsets (uint32, name count + 1) followed by UTF-8 name bytes
+DEBUG_MAGIC = b"HDBG"
+DEBUG_VERSION = 1
+DEBUG_HEADER = struct.Struct("<4sHIIIII")
+RUN_RECORD = struct.Struct("<III")
+VARIABLE_RECORD = struct.Struct("<II")
+NO_LABEL = 0xFFFFFFFF
+
+
+def write_debug_map(dbg_file, locations, variables):
+    # Write the map of a program
+    # locations yields (source line, enclosing label or None) for each ROM
+    # address in order; variables holds (name, RAM address) pairs
+    names = []
+    name_ids = {}
+
+    def nameId(name):
+        name_id = name_ids.get(name)
+        if name_id is None:
+            name_id = name_ids[name] = len(names)
+            names.append(name)
+        return name_id
+
+    runs = array('I')
+    run_address = run_line = -1
+    run_label = None
+    ROM_size = 0
+    for ROM_address, (line, label) in enumerate(locations):
+        if label != run_label or line - run_line != ROM_address - run_address:
+            label_id = NO_LABEL if label is None else nameId(label)
+            runs.extend((ROM_address, line, label_id))
+            run_address, run_line, run_label = ROM_address, line, label
+        ROM_size = ROM_address + 1
+    variable_records = array('I')
+    for name, address in sorted(variables, key=lambda variable: variable[1]):
+        variable_records.extend((address, nameId(name)))
+    encoded = [name.encode() for name in names]
+    offsets = array('I', [0])
+    for name in encoded:
+        offsets.append(offsets[-1] + len(name))
+    out_file = open(dbg_file, "wb")
+    out_file.write(DEBUG_HEADER.pack(DEBUG_MAGIC, DEBUG_VERSION, ROM_size, len(runs) // 3,
+                                     len(variable_records) // 2, len(names), offsets[-1]))
+    for table in (runs, variable_records, offsets):
+        if sys.byteorder != "little":
+            table.byteswap()
+        table.tofile(out_file)
+    out_file.write(b"".join(encoded))
+    out_file.close()
+
+
+class DebugMap:
+
+    # Reader for debug map files
+    # Only the header is loaded; lookups binary search the records on disk
+
+    def __init__(self, dbg_file):
+        self.file_handle = open(dbg_file, "rb")
+        header = self.file_handle.read(DEBUG_HEADER.size)
+        (magic, version, self.ROM_size, self.num_runs, self.num_variables,
+         self.num_names, names_size) = DEBUG_HEADER.unpack(header)
+        if magic != DEBUG_MAGIC or version != DEBUG_VERSION:
+            raise RuntimeError("{} is not a version {} debug map".format(dbg_file, DEBUG_VERSION))
+        self.runs_offset = DEBUG_HEADER.size
+        self.variables_offset = self.runs_offset + self.num_runs * RUN_RECORD.size
+        self.names_offset = self.variables_offset + self.num_variables * VARIABLE_RECORD.size
+        self.blob_offset = self.names_offset + (self.num_names + 1) * 4
+
+    def __del__(self):
+        self.file_handle.close()
+
+    def readRecord(self, record, offset, index):
+        self.file_handle.seek(offset + index * record.size)
+        return record.unpack(self.file_handle.read(record.size))
+
+    def lookup(self, ROM_address):
+        # (source line, enclosing label) of a ROM address, or None
+        if not 0 <= ROM_address < self.ROM_size:
+            return None
+        keys = _RecordKeys(self, RUN_RECORD, self.runs_offset, self.num_runs)
+        index = bisect.bisect_right(keys, ROM_address) - 1
+        run_address, line, label_id = self.readRecord(RUN_RECORD, self.runs_offset, index)
+        return line + ROM_address - run_address, self.name(label_id)
+
+    def variable(self, RAM_address):
+        # Name of the variable stored at a RAM address, or None
+        keys = _RecordKeys(self, VARIABLE_RECORD, self.variables_offset, self.num_variables)
+        index = bisect.bisect_left(keys, RAM_address)
+        if index == self.num_variables:
+            return None
+        address, name_id = self.readRecord(VARIABLE_RECORD, self.variables_offset, index)
+        if address != RAM_address:
+            return None
+        return self.name(name_id)
+
+    def variables(self):
+        # All (name, RAM address) pairs in address order
+        for index in range(self.num_variables):
+            address, name_id = self.readRecord(VARIABLE_RECORD, self.variables_offset, index)
+            yield self.name(name_id), address
+
+    def name(self, name_id):
+        if name_id == NO_LABEL:
+            return None
+        self.file_handle.seek(self.names_offset + name_id * 4)
+        start, end = struct.unpack("<II", self.file_handle.read(8))
+        self.file_handle.seek(self.blob_offset + start)
+        return self.file_handle.read(end - start).decode()
+
+
+class _RecordKeys:
+
+    # Sequence view of the leading field of on-disk records, for bisect
+
+    def __init__(self, debug_map, record, offset, length):
+        self.debug_map = debug_map
+        self.record = record
+        self.offset = offset
+        self.length = length
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, index):
+        return self.debug_map.readRecord(self.record, self.offset, index)[0]
+
+
+if __name__ == '__main__':
+    assert(len(sys.argv) >= 3)
+    debug_map = DebugMap(sys.argv[1])
+    for address in sys.argv[2:]:
+        location = debug_map.lookup(int(address))
+        if location is None:
+            print("{}: unknown".format(address))
+        else:
+            print("{}: line {} in {}".format(address, location[0], location[1]))
@@ -0,0 +1,181 @@
+import os
+import struct
+import sys
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+
+from assembler import *
+
+
+# Object file layout (little-endian):
+#   header: magic, version, word count, reference count, label count, name bytes
+#   words (uint16), reference offsets and symbol ids (uint32),
+#   label offsets and symbol ids (uint32), newline separated symbol names
+OBJECT_MAGIC = b"HOBJ"
+OBJECT_VERSION = 1
+OBJECT_HEADER = struct.Struct("<4sHIIII")
+
+
+class ObjectModule:
+
+    # Relocatable assembly of one .asm module
+    # Literal A instructions and all C instructions are fully encoded; every
+    # symbolic A instruction is left as 0 with a reference to patch at link
+    # time, since labels, variables and predefined symbols are all global
+
+    def __init__(self, name):
+        self.name = name
+        self.words = array('H')
+        self.ref_offsets = array('I')
+        self.ref_symbols = array('I')
+        self.label_offsets = array('I')
+        self.label_symbols = array('I')
+        self.symbol_names = []
+
+    def __len__(self):
+        return len(self.words)
+
+    @classmethod
+    def fromAsm(cls, asm_file):
+        # Assemble a module without resolving any symbols
+        parser = Parser(asm_file)
+        parser.preprocess()
+        return cls.fromCommands(parser.file_lines, asm_file)
+
+    @classmethod
+    def fromCommands(cls, commands, name):
+        # Assemble preprocessed commands without resolving any symbols
+        ir = Parser.parseCommands(commands)
+        coder = Coder()
+        module = cls(name)
+        module.symbol_names = ir.symbol_names
+        for i in range(len(ir)):
+            kind = ir.kinds[i]
+            if kind == L_COMMAND:
+                module.label_offsets.append(len(module.words))
+                module.label_symbols.append(ir.symbols[i])
+            elif kind == A_COMMAND:
+                symbol = ir.symbol_names[ir.symbols[i]]
+                if symbol.isnumeric():
+                    module.words.append(coder.encodeA(int(symbol)))
+                else:
+                    module.ref_offsets.append(len(module.words))
+                    module.ref_symbols.append(ir.symbols[i])
+                    module.words.append(0)
+            else:
+                module.words.append(coder.encodeC(ir.comps[i], ir.dests[i], ir.jumps[i]))
+        return module
+
+    def save(self, obj_file):
+        # Write the module in the binary object format; it is written to a
+        # temporary file and renamed, so readers never see a partial file
+        names = "\n".join(self.symbol_names).encode()
+        tmp_file = "{}.{}.tmp".format(obj_file, os.getpid())
+        out_file = open(tmp_file, "wb")
+        out_file.write(OBJECT_HEADER.pack(OBJECT_MAGIC, OBJECT_VERSION, len(self.words),
+                                          len(self.ref_offsets), len(self.label_offsets), len(names)))
+        for table in (self.words, self.ref_offsets, self.ref_symbols, self.label_offsets, self.label_symbols):
+            table = array(table.typecode, table)
+            if sys.byteorder != "little":
+                table.byteswap()
+            table.tofile(out_file)
+        out_file.write(names)
+        out_file.close()
+        os.replace(tmp_file, obj_file)
+
+    @classmethod
+    def load(cls, obj_file, name=None):
+        # Read a module written by save
+        in_file = open(obj_file, "rb")
+        data = in_file.read()
+        in_file.close()
+        magic, version, num_words, num_refs, num_labels, names_size = OBJECT_HEADER.unpack_from(data)
+        if magic != OBJECT_MAGIC or version != OBJECT_VERSION:
+            raise RuntimeError("{} is not a version {} object file".format(obj_file, OBJECT_VERSION))
+        module = cls(name or obj_file)
+        offset = OBJECT_HEADER.size
+        for attr, count in (("words", num_words), ("ref_offsets", num_refs), ("ref_symbols", num_refs),
+                            ("label_offsets", num_labels), ("label_symbols", num_labels)):
+            table = getattr(module, attr)
+            size = count * table.itemsize
+            table.frombytes(data[offset:offset + size])
+            if sys.byteorder != "little":
+                table.byteswap()
+            offset += size
+        if offset + names_size != len(data):
+            raise RuntimeError("{} is truncated".format(obj_file))
+        names = data[offset:offset + names_size].decode()
+        module.symbol_names = names.split("\n") if names_size else []
+        return module
+
+
+class Linker:
+
+    def __init__(self, modules):
+        self.modules = modules
+        self.coder = Coder()
+        self.ST = SymbolTable()
+        self.next_RAM_address = 16
+        self.words = None
+
+    def link(self):
+        # Place modules back to back and resolve every symbolic reference
+        # Labels are collected first; variables are then allocated from 16
+        # upward in order of first reference, exactly as when the modules
+        # are assembled as one concatenated file
+        base = 0
+        for module in self.modules:
+            for offset, symbol_id in zip(module.label_offsets, module.label_symbols):
+                self.ST.addLabel(module.symbol_names[symbol_id], base + offset)
+            base += len(module)
+        self.words = array('H')
+        for module in self.modules:
+            words = array('H', module.words)
+            for offset, symbol_id in zip(module.ref_offsets, module.ref_symbols):
+                words[offset] = self.coder.encodeA(self.resolve(module.symbol_names[symbol_id]))
+            self.words.extend(words)
+        return self.words
+
+    def resolve(self, symbol):
+        # Address of a symbol, allocating variables on first use
+        if not self.ST.contains(symbol):
+            self.ST.addEntry(symbol, self.next_RAM_address)
+            self.next_RAM_address += 1
+        return self.ST.getAddress(symbol)
+
+
+def object_name(asm_file):
+    return os.path.splitext(asm_file)[0] + ".hobj"
+
+
+def assemble_object(asm_file):
+    # Assemble one module, reusing its object file if it is up to date
+    obj_file = object_name(asm_file)
+    if os.path.exists(obj_file) and os.path.getmtime(obj_file) >= os.path.getmtime(asm_file):
+        try:
+            return ObjectModule.load(obj_file, asm_file)
+        except (OSError, struct.error, ValueError, RuntimeError):
+            # Unreadable or from another format version: rebuild it
+            pass
+    module = ObjectModule.fromAsm(asm_file)
+    module.save(obj_file)
+    return module
+
+
+def build(asm_files, hack_file, rom=False, workers=None):
+    # Assemble modules in parallel, then link them in the given order
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        modules = list(pool.map(assemble_object, asm_files))
+    linker = Linker(modules)
+    words = linker.link()
+    linker.coder.writeHack(words, hack_file)
+    if rom:
+        linker.coder.writeRom(words, os.path.splitext(hack_file)[0] + ".rom")
+    return linker
+
+
+if __name__ == '__main__':
+    assert(len(sys.argv) >= 3)
+    hack_file = sys.argv[1]
+    asm_files = sys.argv[2:]
+    build(asm_files, hack_file)
@@ -0,0 +1,242 @@
+import hashlib
+import os
+import re
+import sys
+import time
+
+from emulator import *
+from assembler import DEST_MNEMONICS, JUMP_MNEMONICS
+
+
+# Python condition on the result t for each jump code
+JUMP_TESTS = {1: "0 < t < 0x8000", 2: "t == 0", 3: "t < 0x8000", 4: "t >= 0x8000",
+              5: "t != 0", 6: "t == 0 or t >= 0x8000", 7: "True"}
+
+# Compiled blocks shared by every emulator running the same ROM
+_BLOCK_CACHE = {}
+
+
+class BlockTranslator:
+
+    # Translates a ROM into one straight-line Python function per basic
+    # block. Each function takes (RAM, A, D) and returns (A, D, next PC)
+    # Blocks start at 0, after every jump and at every address an A
+    # instruction loads, which covers all labels and return addresses;
+    # any other entry point is translated on demand
+
+    def __init__(self, rom):
+        self.rom = rom
+
+    def leaders(self):
+        ROM_size = len(self.rom)
+        leaders = {0}
+        for address, word in enumerate(self.rom):
+            if not word & 0x8000:
+                if word < ROM_size:
+                    leaders.add(word)
+            elif word & 7:
+                leaders.add(address + 1)
+        return sorted(leader for leader in leaders if leader < ROM_size)
+
+    def translate(self, leaders, leader_set=None):
+        # Source of a module defining the block functions for leaders, and
+        # BLOCKS mapping each leader to (function, length)
+        if leader_set is None:
+            leader_set = set(leaders)
+        lines = []
+        lengths = []
+        for leader in leaders:
+            block_lines, length = self.translateBlock(leader, leader_set)
+            lines.extend(block_lines)
+            lengths.append("{0}: (block_{0}, {1}),".format(leader, length))
+        lines.append("BLOCKS = {")
+        lines.extend("    " + line for line in lengths)
+        lines.append("}")
+        return "\n".join(lines) + "\n"
+
+    def translateBlock(self, leader, leader_set):
+        # Source lines of one block function, and its length
+        rom = self.rom
+        ROM_size = len(rom)
+        body = []
+        # a_const is the known value of A, a_pending when it is not yet stored
+        a_const = None
+        a_pending = False
+        address = leader
+        exit_pc = None
+        while address < ROM_size:
+            word = rom[address]
+            address += 1
+            if not word & 0x8000:
+                a_const = word
+                a_pending = True
+                body.append("# @{}".format(word))
+            else:
+                comp_bits = (word >> 6) & 0x7F
+                if comp_bits not in COMP_TABLE:
+                    raise ValueError("Invalid comp field in instruction {:016b}".format(word))
+                mnemonic = COMP_TABLE[comp_bits][0]
+                dest = (word >> 3) & 7
+                jump = word & 7
+                body.append("# {}{}{}".format(DEST_MNEMONICS[dest] + "=" if dest else "", mnemonic,
+                                              ";" + JUMP_MNEMONICS[jump] if jump else ""))
+                if a_const is None:
+                    a_value, m_ref = "A", "RAM[A & 0x7FFF]"
+                else:
+                    a_value, m_ref = str(a_const), "RAM[{}]".format(a_const & 0x7FFF)
+                expression = re.sub(r"\bA\b", a_value, COMP_EXPRESSIONS[mnemonic])
+                expression = re.sub(r"\bM\b", m_ref, expression)
+                if jump:
+                    if a_const is not None:
+                        target = str(a_const)
+                    elif dest & 4:
+                        # The jump goes to A as it was before this instruction
+                        body.append("target = A")
+                        target = "target"
+                    else:
+                        target = "A"
+                targets = []
+                if dest & 1:
+                    targets.append(m_ref)
+                if dest & 4:
+                    targets.append("A")
+                if dest & 2:
+                    targets.append("D")
+                if jump:
+                    targets.append("t")
+                if targets:
+                    body.append("{} = {}".format(" = ".join(targets), expression))
+                if dest & 4:
+                    a_const = None
+                    a_pending = False
+                if jump:
+                    store = "A = {}; ".format(a_const) if a_pending else ""
+                    body.append("if {}: {}return A, D, {}".format(JUMP_TESTS[jump], store, target))
+                    exit_pc = address
+                    break
+            if address in leader_set:
+                exit_pc = address
+                break
+        if exit_pc is None:
+            exit_pc = address
+        if a_pending:
+            body.append("A = {}".format(a_const))
+        body.append("return A, D, {}".format(exit_pc))
+        lines = ["def block_{}(RAM, A, D):".format(leader)]
+        lines.extend("    " + line for line in body)
+        return lines, address - leader
+
+    @staticmethod
+    def isHaltLoop(rom, leader):
+        # @leader 0;JMP at leader loops forever on itself
+        return leader + 1 < len(rom) and rom[leader] == leader and rom[leader + 1] == 0b1110101010000111
+
+
+class BlockEmulator(Emulator):
+
+    # Emulator running a ROM as compiled basic-block functions
+    # Cycle counts, halting and final state match Emulator.run exactly;
+    # when fewer cycles remain than a block needs, the interpreter takes
+    # over for the rest of the budget
+    # block_hook, when set, is called as block_hook(PC, length, next_PC)
+    # after each compiled block runs
+
+    def __init__(self, rom, cache_dir=None):
+        Emulator.__init__(self, rom)
+        self.block_hook = None
+        self.translator = BlockTranslator(self.rom)
+        self.rom_hash = hashlib.sha256(self.rom.tobytes()).hexdigest()
+        self.cache_dir = cache_dir
+        self.blocks = self.compileBlocks()
+
+    def compileBlocks(self):
+        # Block functions and lengths, keyed by entry address
+        blocks = _BLOCK_CACHE.get(self.rom_hash)
+        if blocks is not None:
+            return blocks
+        source = None
+        if self.cache_dir is not None:
+            source_file = os.path.join(self.cache_dir, self.rom_hash + ".py")
+            if os.path.exists(source_file):
+                in_file = open(source_file, "rt")
+                source = in_file.read()
+                in_file.close()
+        if source is None:
+            source = self.translator.translate(self.translator.leaders())
+            if self.cache_dir is not None:
+                os.makedirs(self.cache_dir, exist_ok=True)
+                tmp_file = "{}.{}.tmp".format(source_file, os.getpid())
+                out_file = open(tmp_file, "wt")
+                out_file.write(source)
+                out_file.close()
+                os.replace(tmp_file, source_file)
+        blocks = {}
+        self.load(source, blocks)
+        _BLOCK_CACHE[self.rom_hash] = blocks
+        return blocks
+
+    def load(self, source, blocks):
+        # Compile block source and register its functions
+        namespace = {}
+        exec(compile(source, "<rom {}>".format(self.rom_hash[:12]), "exec"), namespace)
+        for leader, (function, length) in namespace["BLOCKS"].items():
+            blocks[leader] = (function, length, self.translator.isHaltLoop(self.rom, leader))
+
+    def block(self, PC):
+        # Block entered at PC, translating it on demand
+        block = self.blocks.get(PC)
+        if block is None:
+            self.load(self.translator.translate([PC], set(self.blocks) | {PC}), self.blocks)
+            block = self.blocks[PC]
+        return block
+
+    def run(self, max_cycles):
+        # Execute up to max_cycles instructions, block by block
+        RAM = self.RAM
+        ROM_size = len(self.rom)
+        blocks = self.blocks
+        block_hook = self.block_hook
+        A, D, PC = self.A, self.D, self.PC
+        cycle = 0
+        while True:
+            if PC >= ROM_size:
+                self.halted = True
+                break
+            block = blocks.get(PC)
+            if block is None:
+                block = self.block(PC)
+            function, length, halts = block
+            if cycle + length > max_cycles or halts:
+                # Finish in the interpreter, which also detects halt loops
+                self.A, self.D, self.PC = A, D, PC
+                self.cycles += cycle
+                return cycle + Emulator.run(self, max_cycles - cycle)
+            A, D, next_PC = function(RAM, A, D)
+            if block_hook is not None:
+                block_hook(PC, length, next_PC)
+            PC = next_PC
+            cycle += length
+        self.A, self.D, self.PC = A, D, PC
+        self.cycles += cycle
+        return cycle
+
+
+def verify(path, max_cycles):
+    # Run a program in both emulators and compare their final states
+    reference = Emulator.fromFile(path)
+    compiled = BlockEmulator(reference.rom)
+    cycles = (reference.run(max_cycles), compiled.run(max_cycles))
+    return (cycles[0] == cycles[1] and reference.RAM == compiled.RAM and
+            (reference.A, reference.D, reference.PC, reference.halted) ==
+            (compiled.A, compiled.D, compiled.PC, compiled.halted))
+
+
+if __name__ == '__main__':
+    assert(len(sys.argv) in (2, 3))
+    max_cycles = int(sys.argv[2]) if len(sys.argv) == 3 else 10000000
+    emulator = BlockEmulator(Emulator.fromFile(sys.argv[1]).rom)
+    start = time.perf_counter()
+    cycles = emulator.run(max_cycles)
+    elapsed = time.perf_counter() - start
+    print("{} cycles in {:.3f}s ({:.0f} instructions/s), halted={}".format(
+        cycles, elapsed, cycles / elapsed if elapsed else 0, emulator.halted))
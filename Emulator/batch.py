@@ -0,0 +1,194 @@
+import hashlib
+import sys
+import time
+import zlib
+
+import numpy as np
+
+from emulator import *
+
+
+class BatchEmulator:
+
+    # N independent Hack machines running the same ROM, with A, D, PC and
+    # RAM held in NumPy arrays. Each step groups the running instances by
+    # PC and executes every group's instruction as one vectorized
+    # operation, so instances that take different branches only cost an
+    # extra group until they meet again. Halting and cycle counts follow
+    # Emulator.run for every instance
+
+    def __init__(self, rom, instances):
+        self.rom = array('H', rom)
+        self.instances = instances
+        self.program = self.decode(self.rom)
+        self.reset()
+
+    @classmethod
+    def fromFile(cls, path, instances):
+        # Load a .hack text file or a packed .rom image
+        if path.endswith(".rom"):
+            return cls(load_rom(path), instances)
+        return cls(load_hack(path), instances)
+
+    def reset(self):
+        # Reset every CPU and clear RAM
+        self.RAM = np.zeros((self.instances, RAM_SIZE), dtype=np.uint16)
+        self.A = np.zeros(self.instances, dtype=np.int32)
+        self.D = np.zeros(self.instances, dtype=np.int32)
+        self.PC = np.zeros(self.instances, dtype=np.int32)
+        self.cycles = np.zeros(self.instances, dtype=np.int64)
+        self.halted = np.zeros(self.instances, dtype=bool)
+
+    @staticmethod
+    def decode(rom):
+        # Turn each ROM word into an int (A instruction) or a tuple of
+        # (comp function, reads M, dest mask, jump condition or None, halt
+        # check), where halt check marks 0;JMP like Emulator's OP_JMP
+        program = []
+        functions = {}
+        for word in rom:
+            if not word & 0x8000:
+                program.append(word)
+                continue
+            comp_bits = (word >> 6) & 0x7F
+            if comp_bits not in COMP_TABLE:
+                raise ValueError("Invalid comp field in instruction {:016b}".format(word))
+            mnemonic = COMP_TABLE[comp_bits][0]
+            comp = functions.get(mnemonic)
+            if comp is None:
+                comp = functions[mnemonic] = eval("lambda A, D, M: " + COMP_EXPRESSIONS[mnemonic])
+            jump = word & 7
+            dest = (word >> 3) & 7
+            program.append((comp, "M" in mnemonic, dest, JUMP_CONDITIONS[jump] if jump else None,
+                            FAST_OPS.get((mnemonic, dest, jump)) == OP_JMP))
+        return program
+
+    def run(self, max_cycles):
+        # Execute up to max_cycles instructions on every instance; returns
+        # the number of steps taken, which is the cycle count of the
+        # longest running instance
+        ROM_size = len(self.program)
+        step = 0
+        while step < max_cycles:
+            running = np.flatnonzero(~self.halted)
+            if len(running) == 0:
+                break
+            PCs = self.PC[running]
+            off_end = PCs >= ROM_size
+            if off_end.any():
+                self.halted[running[off_end]] = True
+                running = running[~off_end]
+                PCs = PCs[~off_end]
+                if len(running) == 0:
+                    break
+            first, last = PCs.min(), PCs.max()
+            if first == last:
+                self.execute(int(first), running)
+            else:
+                order = np.argsort(PCs, kind="stable")
+                PCs = PCs[order]
+                running = running[order]
+                starts = np.flatnonzero(np.diff(PCs)) + 1
+                for group in np.split(np.arange(len(running)), starts):
+                    self.execute(int(PCs[group[0]]), running[group])
+            self.cycles[running] += 1
+            step += 1
+        return step
+
+    def execute(self, PC, group):
+        # Execute the instruction at PC on the instances in group
+        instruction = self.program[PC]
+        if instruction.__class__ is int:
+            self.A[group] = instruction
+            self.PC[group] = PC + 1
+            return
+        comp, reads_M, dest, jump, halt_check = instruction
+        A = self.A[group]
+        D = self.D[group]
+        address = A & 0x7FFF
+        M = self.RAM[group, address].astype(np.int32) if reads_M else None
+        out = comp(A, D, M)
+        if np.isscalar(out):
+            out = np.full(len(group), out, dtype=np.int32)
+        if dest & 1:
+            self.RAM[group, address] = out
+        if dest & 4:
+            self.A[group] = out
+        if dest & 2:
+            self.D[group] = out
+        if jump is None:
+            self.PC[group] = PC + 1
+            return
+        negative, zero, positive = jump
+        taken = np.zeros(len(group), dtype=bool)
+        if negative:
+            taken |= out >= 0x8000
+        if zero:
+            taken |= out == 0
+        if positive:
+            taken |= (out != 0) & (out < 0x8000)
+        # The jump goes to A as it was before this instruction
+        self.PC[group] = np.where(taken, A, PC + 1)
+        if halt_check and self.program[PC - 1] == PC - 1:
+            # Unconditional jump back to its own address load
+            self.halted[group[taken & (A == PC - 1)]] = True
+
+    def restore(self, snapshot):
+        # Start every instance from the state saved by Emulator.snapshot
+        (magic, version, A, D, PC, cycles, halted, rom_hash) = SNAPSHOT_HEADER.unpack_from(snapshot)
+        if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+            raise RuntimeError("Not a version {} snapshot".format(SNAPSHOT_VERSION))
+        if rom_hash != hashlib.sha256(self.rom.tobytes()).digest():
+            raise RuntimeError("Snapshot was taken with a different ROM")
+        RAM = np.frombuffer(zlib.decompress(snapshot[SNAPSHOT_HEADER.size:]), dtype="<u2")
+        if len(RAM) != RAM_SIZE:
+            raise RuntimeError("Snapshot RAM has {} words, not {}".format(len(RAM), RAM_SIZE))
+        self.RAM[:] = RAM
+        self.A[:], self.D[:], self.PC[:] = A, D, PC
+        self.cycles[:] = cycles
+        self.halted[:] = halted
+
+    def setKey(self, key_codes):
+        # Set the keyboard memory map of every instance, from one key code
+        # or one per instance
+        self.RAM[:, KBD] = key_codes
+
+    def peek(self, address):
+        # Signed value of a RAM word in every instance
+        return self.RAM[:, address].astype(np.int16).astype(np.int32)
+
+    def poke(self, address, values):
+        # Set a RAM word in every instance, from one value or one per instance
+        self.RAM[:, address] = np.asarray(values, dtype=np.int64) & 0xFFFF
+
+
+def verify(path, instances, max_cycles, seed=0):
+    # Run random initial RAM through the batch and through one Emulator
+    # per instance, and compare their final states
+    rng = np.random.default_rng(seed)
+    batch = BatchEmulator.fromFile(path, instances)
+    batch.RAM[:, :256] = rng.integers(0, 0x10000, size=(instances, 256), dtype=np.uint16)
+    initial = batch.RAM.copy()
+    batch.run(max_cycles)
+    for instance in range(instances):
+        reference = Emulator(batch.rom)
+        reference.RAM = array('H', initial[instance].tobytes())
+        reference.run(max_cycles)
+        if (reference.RAM.tobytes() != batch.RAM[instance].tobytes() or
+                (reference.A, reference.D, reference.PC, reference.cycles, reference.halted) !=
+                (batch.A[instance], batch.D[instance], batch.PC[instance],
+                 batch.cycles[instance], batch.halted[instance])):
+            return False
+    return True
+
+
+if __name__ == '__main__':
+    assert(len(sys.argv) in (3, 4))
+    batch = BatchEmulator.fromFile(sys.argv[1], int(sys.argv[2]))
+    max_cycles = int(sys.argv[3]) if len(sys.argv) == 4 else 100000
+    start = time.perf_counter()
+    steps = batch.run(max_cycles)
+    elapsed = time.perf_counter() - start
+    total = int(batch.cycles.sum())
+    print("{} instances, {} steps, {} instructions in {:.3f}s ({:.0f} instructions/s), {} halted".format(
+        batch.instances, steps, total, elapsed, total / elapsed if elapsed else 0, int(batch.halted.sum())))
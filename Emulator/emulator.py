@@ -0,0 +1,250 @@
+import hashlib
+import os
+import struct
+import sys
+import time
+import zlib
+from array import array
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Assembler"))
+from assembler import COMP_MNEMONICS, Coder
+
+
+RAM_SIZE = 0x8000
+SCREEN = 16384
+KBD = 24576
+
+# Snapshot layout (little-endian): magic, version, A, D, PC, cycles,
+# halted, SHA-256 of the ROM, then the zlib compressed RAM words
+SNAPSHOT_MAGIC = b"HSNP"
+SNAPSHOT_VERSION = 1
+SNAPSHOT_HEADER = struct.Struct("<4sHHHHQ?32s")
+
+# Python expression of each comp mnemonic over unsigned 16 bit registers
+COMP_EXPRESSIONS = {"0": "0", "1": "1", "-1": "0xFFFF", "D": "D", "A": "A", "M": "M",
+                    "!D": "D ^ 0xFFFF", "!A": "A ^ 0xFFFF", "!M": "M ^ 0xFFFF",
+                    "-D": "-D & 0xFFFF", "-A": "-A & 0xFFFF", "-M": "-M & 0xFFFF",
+                    "D+1": "(D + 1) & 0xFFFF", "A+1": "(A + 1) & 0xFFFF", "M+1": "(M + 1) & 0xFFFF",
+                    "D-1": "(D - 1) & 0xFFFF", "A-1": "(A - 1) & 0xFFFF", "M-1": "(M - 1) & 0xFFFF",
+                    "D+A": "(D + A) & 0xFFFF", "D+M": "(D + M) & 0xFFFF",
+                    "D-A": "(D - A) & 0xFFFF", "D-M": "(D - M) & 0xFFFF",
+                    "A-D": "(A - D) & 0xFFFF", "M-D": "(M - D) & 0xFFFF",
+                    "D&A": "D & A", "D&M": "D & M", "D|A": "D | A", "D|M": "D | M"}
+
+# Jump taken on (negative, zero, positive) result for each jump code
+JUMP_CONDITIONS = [((code >> 2) & 1 == 1, (code >> 1) & 1 == 1, code & 1 == 1) for code in range(8)]
+
+# Fast path ops for the most frequent (comp, dest, jump) combinations
+OP_GENERIC = 0
+OP_D_M = 1
+OP_A_M = 2
+OP_M_D = 3
+OP_M_INC = 4
+OP_M_DEC = 5
+OP_D_A = 6
+OP_JMP = 7
+FAST_OPS = {("M", 2, 0): OP_D_M, ("M", 4, 0): OP_A_M, ("D", 1, 0): OP_M_D,
+            ("M+1", 1, 0): OP_M_INC, ("M-1", 1, 0): OP_M_DEC, ("A", 2, 0): OP_D_A,
+            ("0", 0, 7): OP_JMP}
+
+
+def comp_table():
+    # Map the 7 bit a+c field of a C instruction to (mnemonic, function)
+    # The encodings come from the assembler's Coder tables, so the two
+    # can never disagree
+    coder = Coder()
+    table = {}
+    for comp_id, mnemonic in enumerate(COMP_MNEMONICS):
+        comp_bits = (coder.comp_words[comp_id] >> 6) & 0x7F
+        function = eval("lambda A, D, M: " + COMP_EXPRESSIONS[mnemonic])
+        table[comp_bits] = (mnemonic, function)
+    return table
+
+
+COMP_TABLE = comp_table()
+
+
+def load_hack(hack_file):
+    # ROM words from a text .hack file
+    in_file = open(hack_file, "rt")
+    words = array('H', [int(line, 2) for line in in_file if line.strip()])
+    in_file.close()
+    return words
+
+
+def load_rom(rom_file):
+    # ROM words from a packed little-endian .rom image
+    words = array('H')
+    in_file = open(rom_file, "rb")
+    words.frombytes(in_file.read())
+    in_file.close()
+    if sys.byteorder != "little":
+        words.byteswap()
+    return words
+
+
+class Emulator:
+
+    def __init__(self, rom):
+        self.rom = array('H', rom)
+        self.program = self.decode(self.rom)
+        self.RAM = array('H', bytes(2 * RAM_SIZE))
+        self.A = 0
+        self.D = 0
+        self.PC = 0
+        self.cycles = 0
+        self.halted = False
+
+    @classmethod
+    def fromFile(cls, path):
+        # Load a .hack text file or a packed .rom image
+        if path.endswith(".rom"):
+            return cls(load_rom(path))
+        return cls(load_hack(path))
+
+    def reset(self):
+        # Reset the CPU and clear RAM
+        self.RAM = array('H', bytes(2 * RAM_SIZE))
+        self.A = self.D = self.PC = self.cycles = 0
+        self.halted = False
+
+    @staticmethod
+    def decode(rom):
+        # Turn each ROM word into an int (A instruction) or a tuple of
+        # (fast path op, comp function, dest mask, jump condition or None)
+        program = []
+        decoded = {}
+        for word in rom:
+            if not word & 0x8000:
+                program.append(word)
+                continue
+            instruction = decoded.get(word)
+            if instruction is None:
+                comp_bits = (word >> 6) & 0x7F
+                if comp_bits not in COMP_TABLE:
+                    raise ValueError("Invalid comp field in instruction {:016b}".format(word))
+                mnemonic, comp = COMP_TABLE[comp_bits]
+                dest = (word >> 3) & 7
+                jump = word & 7
+                op = FAST_OPS.get((mnemonic, dest, jump), OP_GENERIC)
+                instruction = (op, comp, dest, JUMP_CONDITIONS[jump] if jump else None)
+                decoded[word] = instruction
+            program.append(instruction)
+        return program
+
+    def run(self, max_cycles):
+        # Execute up to max_cycles instructions; stops early when the
+        # program runs off the end of ROM or reaches a halt loop such as
+        # (END) @END 0;JMP. Returns the number of cycles executed
+        program = self.program
+        RAM = self.RAM
+        ROM_size = len(program)
+        A, D, PC = self.A, self.D, self.PC
+        cycle = 0
+        while cycle < max_cycles:
+            if PC >= ROM_size:
+                self.halted = True
+                break
+            instruction = program[PC]
+            cycle += 1
+            if instruction.__class__ is int:
+                A = instruction
+                PC += 1
+                continue
+            op, comp, dest, jump = instruction
+            # The most frequent instructions of generated code run inline
+            if op == OP_D_M:
+                D = RAM[A & 0x7FFF]
+            elif op == OP_A_M:
+                A = RAM[A & 0x7FFF]
+            elif op == OP_M_D:
+                RAM[A & 0x7FFF] = D
+            elif op == OP_M_INC:
+                RAM[A & 0x7FFF] = (RAM[A & 0x7FFF] + 1) & 0xFFFF
+            elif op == OP_M_DEC:
+                RAM[A & 0x7FFF] = (RAM[A & 0x7FFF] - 1) & 0xFFFF
+            elif op == OP_D_A:
+                D = A
+            elif op == OP_JMP:
+                if A == PC - 1 and program[A] == A:
+                    # Unconditional jump back to its own address load
+                    PC = A
+                    self.halted = True
+                    break
+                PC = A
+                continue
+            else:
+                out = comp(A, D, RAM[A & 0x7FFF])
+                target = A
+                if dest & 1:
+                    RAM[A & 0x7FFF] = out
+                if dest & 4:
+                    A = out
+                if dest & 2:
+                    D = out
+                if jump is not None:
+                    if out == 0:
+                        taken = jump[1]
+                    elif out & 0x8000:
+                        taken = jump[0]
+                    else:
+                        taken = jump[2]
+                    if taken:
+                        PC = target
+                        continue
+            PC += 1
+        self.A, self.D, self.PC = A, D, PC
+        self.cycles += cycle
+        return cycle
+
+    def romHash(self):
+        return hashlib.sha256(self.rom.tobytes()).digest()
+
+    def snapshot(self):
+        # Full machine state as compact bytes
+        RAM = self.RAM
+        if sys.byteorder != "little":
+            RAM = array('H', RAM)
+            RAM.byteswap()
+        header = SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, self.A, self.D, self.PC,
+                                      self.cycles, self.halted, self.romHash())
+        return header + zlib.compress(RAM.tobytes())
+
+    def restore(self, snapshot):
+        # Return to the state saved by snapshot, which must come from the
+        # same ROM; a rejected snapshot leaves the machine untouched
+        (magic, version, A, D, PC, cycles, halted, rom_hash) = SNAPSHOT_HEADER.unpack_from(snapshot)
+        if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+            raise RuntimeError("Not a version {} snapshot".format(SNAPSHOT_VERSION))
+        if rom_hash != self.romHash():
+            raise RuntimeError("Snapshot was taken with a different ROM")
+        RAM = array('H', zlib.decompress(snapshot[SNAPSHOT_HEADER.size:]))
+        if len(RAM) != RAM_SIZE:
+            raise RuntimeError("Snapshot RAM has {} words, not {}".format(len(RAM), RAM_SIZE))
+        if sys.byteorder != "little":
+            RAM.byteswap()
+        self.RAM[:] = RAM
+        self.A, self.D, self.PC, self.cycles, self.halted = A, D, PC, cycles, halted
+
+    def setKey(self, key_code):
+        # Set the keyboard memory map
+        self.RAM[KBD] = key_code
+
+    def peek(self, address):
+        # Signed value of a RAM word
+        value = self.RAM[address]
+        return value - 0x10000 if value & 0x8000 else value
+
+    def poke(self, address, value):
+        self.RAM[address] = value & 0xFFFF
+
+
+if __name__ == '__main__':
+    assert(len(sys.argv) in (2, 3))
+    emulator = Emulator.fromFile(sys.argv[1])
+    max_cycles = int(sys.argv[2]) if len(sys.argv) == 3 else 10000000
+    start = time.perf_counter()
+    cycles = emulator.run(max_cycles)
+    elapsed = time.perf_counter() - start
+    print("{} cycles in {:.3f}s ({:.0f} instructions/s), halted={}".format(
+        cycles, elapsed, cycles / elapsed if elapsed else 0, emulator.halted))
@@ -0,0 +1,113 @@
+import bisect
+import sys
+import time
+from array import array
+
+from aot import *
+from assembler import Assembler, SymbolTable
+
+
+class ProfilingEmulator(BlockEmulator):
+
+    # Block emulator that counts how often each block is entered and each
+    # jump is taken. Every instruction of a block runs whenever the block
+    # is entered, so block counts give exact per-address counts at the
+    # cost of one increment per block. Cycles finished in the interpreter
+    # (halt loops and the tail of a budget) are not counted
+
+    def __init__(self, rom, cache_dir=None):
+        BlockEmulator.__init__(self, rom, cache_dir)
+        self.block_counts = {}
+        self.jump_counts = {}
+        self.block_hook = self.countBlock
+
+    def countBlock(self, PC, length, next_PC):
+        self.block_counts[PC] = self.block_counts.get(PC, 0) + 1
+        if next_PC != PC + length:
+            jump = (PC + length - 1, next_PC)
+            self.jump_counts[jump] = self.jump_counts.get(jump, 0) + 1
+
+    def addressCounts(self):
+        # Executions of each ROM address
+        counts = array('Q', bytes(8 * len(self.rom)))
+        for leader, count in self.block_counts.items():
+            for address in range(leader, leader + self.blocks[leader][1]):
+                counts[address] += count
+        return counts
+
+
+class Profile:
+
+    # Execution counts aggregated by the labels the assembler records
+    # during first_pass; each address belongs to the closest label at or
+    # before it
+
+    def __init__(self, asm_file):
+        self.asm = Assembler(asm_file)
+        self.asm.parser.preprocess()
+        self.asm.ir = self.asm.parser.parse()
+        self.asm.first_pass()
+        # Only labels are in the symbol table at this point
+        predefined = SymbolTable.predefined_symbols()
+        labels = sorted((address, name) for name, address in self.asm.ST.ST.items()
+                        if name not in predefined)
+        self.asm.second_pass()
+        self.label_addresses = [address for address, _ in labels]
+        self.label_names = [name for _, name in labels]
+        self.emulator = ProfilingEmulator(self.asm.words)
+
+    def run(self, max_cycles):
+        return self.emulator.run(max_cycles)
+
+    def labelOf(self, address):
+        index = bisect.bisect_right(self.label_addresses, address) - 1
+        return self.label_names[index] if index >= 0 else "<start>"
+
+    def labelCounts(self):
+        # (label, cycles, taken jumps out of the label's code)
+        cycles = {}
+        jumps = {}
+        for address, count in enumerate(self.emulator.addressCounts()):
+            if count:
+                label = self.labelOf(address)
+                cycles[label] = cycles.get(label, 0) + count
+        for (source, _), count in self.emulator.jump_counts.items():
+            label = self.labelOf(source)
+            jumps[label] = jumps.get(label, 0) + count
+        return [(label, cycles[label], jumps.get(label, 0)) for label in cycles]
+
+    def report(self, top=20):
+        # Ranked hot spot report
+        counts = sorted(self.labelCounts(), key=lambda entry: -entry[1])
+        total = sum(entry[1] for entry in counts) or 1
+        lines = ["{:>12} {:>7} {:>10}  {}".format("cycles", "%", "jumps", "label")]
+        for label, cycles, jumps in counts[:top]:
+            lines.append("{:>12} {:>6.2f}% {:>10}  {}".format(cycles, 100.0 * cycles / total, jumps, label))
+        hot_jumps = sorted(self.emulator.jump_counts.items(), key=lambda entry: -entry[1])[:top]
+        lines.append("")
+        lines.append("{:>12}  {}".format("taken", "jump"))
+        for (source, target), count in hot_jumps:
+            lines.append("{:>12}  {} ({}) -> {} ({})".format(count, source, self.labelOf(source),
+                                                           target, self.labelOf(target)))
+        return "\n".join(lines)
+
+    def writeFlat(self, flat_file):
+        # label<TAB>cycles<TAB>jumps, sorted by label so files diff cleanly
+        # between compiler versions, where ROM addresses shift
+        out_file = open(flat_file, "wt")
+        for label, cycles, jumps in sorted(self.labelCounts()):
+            out_file.write("{}\t{}\t{}\n".format(label, cycles, jumps))
+        out_file.close()
+
+
+if __name__ == '__main__':
+    assert(len(sys.argv) in (2, 3, 4))
+    profile = Profile(sys.argv[1])
+    max_cycles = int(sys.argv[2]) if len(sys.argv) >= 3 else 10000000
+    start = time.perf_counter()
+    cycles = profile.run(max_cycles)
+    elapsed = time.perf_counter() - start
+    print("{} cycles in {:.3f}s, halted={}\n".format(cycles, elapsed, profile.emulator.halted))
+    print(profile.report())
+    if len(sys.argv) == 4:
+        profile.writeFlat(sys.argv[3])
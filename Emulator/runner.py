@@ -0,0 +1,143 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from aot import *
+from assembler import Assembler
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "VMTranslator"))
+from VMTranslator_08 import VMTranslator
+
+
+# Manifest format:
+#   {"cases": [{"name": "fib",
+#               "rom": "Fib.hack"  or  "vm": "FibDir",
+#               "ram": {"0": 256, ...},
+#               "cycles": 100000,
+#               "expect": {"256": 55, ...}}, ...]}
+# Paths are relative to the manifest; RAM addresses are decimal strings
+# and values may be negative
+DEFAULT_CYCLES = 1000000
+
+# ROMs loaded by this worker process, keyed by path and modification time
+_ROMS = {}
+
+
+def load_manifest(manifest_file):
+    # Test cases with absolute paths
+    in_file = open(manifest_file, "rt")
+    manifest = json.load(in_file)
+    in_file.close()
+    base_dir = os.path.dirname(os.path.abspath(manifest_file))
+    cases = manifest["cases"]
+    for i, case in enumerate(cases):
+        case.setdefault("name", "case_{}".format(i))
+        for key in ("rom", "vm"):
+            if key in case:
+                case[key] = os.path.join(base_dir, case[key])
+        if ("rom" in case) == ("vm" in case):
+            raise RuntimeError("Case {} needs exactly one of rom and vm".format(case["name"]))
+    return cases
+
+
+def build_vm(vm_path):
+    # Translate and assemble a .vm file or directory, returning the .hack
+    translator = VMTranslator(vm_path)
+    with contextlib.redirect_stdout(io.StringIO()):
+        translator.translate()
+    translator.coder.close()
+    asm = Assembler(translator.asm_file)
+    asm.assemble()
+    return asm.hack_file
+
+
+def load_cached_rom(path):
+    key = (path, os.path.getmtime(path))
+    rom = _ROMS.get(key)
+    if rom is None:
+        rom = _ROMS[key] = Emulator.fromFile(path).rom
+    return rom
+
+
+def run_case(case):
+    # Run one case and compare the expected RAM values
+    start = time.perf_counter()
+    emulator = BlockEmulator(load_cached_rom(case["rom"]))
+    for address, value in case.get("ram", {}).items():
+        emulator.poke(int(address), value)
+    emulator.run(case.get("cycles", DEFAULT_CYCLES))
+    mismatches = []
+    for address, value in case.get("expect", {}).items():
+        actual = emulator.peek(int(address))
+        if actual & 0xFFFF != value & 0xFFFF:
+            mismatches.append((int(address), value, actual))
+    return {"name": case["name"],
+            "passed": not mismatches,
+            "mismatches": mismatches,
+            "cycles": emulator.cycles,
+            "halted": emulator.halted,
+            "seconds": time.perf_counter() - start}
+
+
+def failed_case(case, error):
+    # Result of a case that raised instead of running to completion
+    return {"name": case["name"],
+            "passed": False,
+            "mismatches": [],
+            "error": "{}: {}".format(type(error).__name__, error),
+            "cycles": 0,
+            "halted": False,
+            "seconds": 0.0}
+
+
+def run_suite(cases, workers=None):
+    # Run cases over a process pool, yielding results as they complete
+    # Each .vm program is built once, before any case using it runs; a
+    # case that raises, or whose program fails to build, is reported as
+    # failed with its error instead of stopping the suite
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        vm_paths = sorted({case["vm"] for case in cases if "vm" in case})
+        builds = {vm_path: pool.submit(build_vm, vm_path) for vm_path in vm_paths}
+        futures = {}
+        for case in cases:
+            if "vm" in case:
+                try:
+                    case["rom"] = builds[case["vm"]].result()
+                except Exception as error:
+                    yield failed_case(case, error)
+                    continue
+            futures[pool.submit(run_case, case)] = case
+        for future in as_completed(futures):
+            try:
+                yield future.result()
+            except Exception as error:
+                yield failed_case(futures[future], error)
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description="Run Hack and VM program tests in parallel")
+    arg_parser.add_argument("manifest")
+    arg_parser.add_argument("--workers", type=int, default=None)
+    arg_parser.add_argument("--slow", type=int, default=5, help="number of slowest cases to report")
+    args = arg_parser.parse_args()
+    start = time.perf_counter()
+    results = []
+    for result in run_suite(load_manifest(args.manifest), args.workers):
+        results.append(result)
+        print("{:<4} {} ({} cycles, {:.3f}s)".format("ok" if result["passed"] else "FAIL",
+                                                     result["name"], result["cycles"], result["seconds"]))
+        if "error" in result:
+            print("     {}".format(result["error"]))
+        for address, expected, actual in result["mismatches"]:
+            print("     RAM[{}] = {}, expected {}".format(address, actual, expected))
+    failed = sum(1 for result in results if not result["passed"])
+    print("\n{} passed, {} failed in {:.3f}s".format(len(results) - failed, failed, time.perf_counter() - start))
+    print("\nSlowest cases:")
+    for result in sorted(results, key=lambda result: -result["seconds"])[:args.slow]:
+        print("{:>10.3f}s {:>12} cycles  {}".format(result["seconds"], result["cycles"], result["name"]))
+    sys.exit(1 if failed else 0)
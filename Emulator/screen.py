@@ -0,0 +1,95 @@
+import os
+import sys
+
+import numpy as np
+
+from aot import *
+
+
+SCREEN_WIDTH = 512
+SCREEN_HEIGHT = 256
+SCREEN_WORDS = SCREEN_WIDTH * SCREEN_HEIGHT // 16
+
+
+def render(RAM):
+    # 256x512 array of pixels (1 = black) from the screen memory map
+    # Pixel c of a row is bit c % 16 of word c // 16, least significant
+    # first, which is little-endian bit order over little-endian bytes
+    words = np.frombuffer(RAM, dtype=np.uint16, count=SCREEN_WORDS, offset=2 * SCREEN)
+    data = words.astype("<u2").view(np.uint8)
+    return np.unpackbits(data, bitorder="little").reshape(SCREEN_HEIGHT, SCREEN_WIDTH)
+
+
+def write_pbm(pbm_file, pixels):
+    # Write pixels as a binary PBM image
+    out_file = open(pbm_file, "wb")
+    out_file.write("P4\n{} {}\n".format(pixels.shape[1], pixels.shape[0]).encode())
+    out_file.write(np.packbits(pixels, axis=1).tobytes())
+    out_file.close()
+
+
+def read_pbm(pbm_file):
+    # Pixels of a binary PBM image written by write_pbm
+    in_file = open(pbm_file, "rb")
+    magic = in_file.readline().strip()
+    width, height = (int(field) for field in in_file.readline().split())
+    data = in_file.read()
+    in_file.close()
+    if magic != b"P4":
+        raise RuntimeError("{} is not a binary PBM image".format(pbm_file))
+    packed = np.frombuffer(data, dtype=np.uint8).reshape(height, -1)
+    return np.unpackbits(packed, axis=1)[:, :width]
+
+
+class ScreenRecorder:
+
+    # Dumps a PBM frame whenever the screen memory map changed since the
+    # last frame, checked every `every` cycles or on request. Changes are
+    # found by comparing the screen region with the last frame, which
+    # keeps the emulator's write path untouched
+
+    def __init__(self, emulator, frame_dir, every=100000):
+        self.emulator = emulator
+        self.frame_dir = frame_dir
+        self.every = every
+        self.frames = []
+        self.last_screen = None
+        self.last_cycles = None
+        os.makedirs(frame_dir, exist_ok=True)
+
+    def screenBytes(self):
+        return self.emulator.RAM[SCREEN:SCREEN + SCREEN_WORDS].tobytes()
+
+    def capture(self, force=False):
+        # Dump a frame if the screen is dirty (or force); returns its file,
+        # or the last frame's file if no cycle ran since it was written
+        if self.emulator.cycles == self.last_cycles:
+            return self.frames[-1] if force else None
+        screen = self.screenBytes()
+        if screen == self.last_screen and not force:
+            return None
+        self.last_screen = screen
+        self.last_cycles = self.emulator.cycles
+        frame_file = os.path.join(self.frame_dir, "frame_{:06d}_{:012d}.pbm".format(
+            len(self.frames), self.emulator.cycles))
+        write_pbm(frame_file, render(self.emulator.RAM))
+        self.frames.append(frame_file)
+        return frame_file
+
+    def run(self, max_cycles):
+        # Run the emulator, capturing dirty frames between slices
+        cycles = 0
+        while cycles < max_cycles and not self.emulator.halted:
+            cycles += self.emulator.run(min(self.every, max_cycles - cycles))
+            self.capture()
+        return cycles
+
+
+if __name__ == '__main__':
+    assert(len(sys.argv) in (3, 4, 5))
+    emulator = BlockEmulator(Emulator.fromFile(sys.argv[1]).rom)
+    max_cycles = int(sys.argv[3]) if len(sys.argv) >= 4 else 10000000
+    every = int(sys.argv[4]) if len(sys.argv) == 5 else 100000
+    recorder = ScreenRecorder(emulator, sys.argv[2], every)
+    cycles = recorder.run(max_cycles)
+    print("{} cycles, {} frames written to {}".format(cycles, len(recorder.frames), sys.argv[2]))
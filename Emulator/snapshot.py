@@ -0,0 +1,57 @@
+import hashlib
+import os
+import sys
+
+from emulator import *
+
+
+class SnapshotStore:
+
+    # Directory of emulator snapshots named by the SHA-256 of their
+    # contents, so identical states are stored once. Loaded snapshots are
+    # kept in memory, making repeated restores a decompress and a copy
+
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        self.loaded = {}
+        os.makedirs(store_dir, exist_ok=True)
+
+    def path(self, digest):
+        return os.path.join(self.store_dir, digest + ".snap")
+
+    def save(self, emulator):
+        # Snapshot an emulator and return its digest
+        snapshot = emulator.snapshot()
+        digest = hashlib.sha256(snapshot).hexdigest()
+        snapshot_file = self.path(digest)
+        if not os.path.exists(snapshot_file):
+            tmp_file = "{}.{}.tmp".format(snapshot_file, os.getpid())
+            out_file = open(tmp_file, "wb")
+            out_file.write(snapshot)
+            out_file.close()
+            os.replace(tmp_file, snapshot_file)
+        self.loaded[digest] = snapshot
+        return digest
+
+    def load(self, digest):
+        # Snapshot bytes for a digest
+        snapshot = self.loaded.get(digest)
+        if snapshot is None:
+            in_file = open(self.path(digest), "rb")
+            snapshot = in_file.read()
+            in_file.close()
+            if hashlib.sha256(snapshot).hexdigest() != digest:
+                raise RuntimeError("Snapshot {} is corrupt".format(digest))
+            self.loaded[digest] = snapshot
+        return snapshot
+
+    def restore(self, emulator, digest):
+        # Return an emulator to a stored state
+        emulator.restore(self.load(digest))
+
+
+if __name__ == '__main__':
+    assert(len(sys.argv) == 4)
+    emulator = Emulator.fromFile(sys.argv[2])
+    emulator.run(int(sys.argv[3]))
+    print(SnapshotStore(sys.argv[1]).save(emulator))
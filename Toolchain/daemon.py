@@ -0,0 +1,175 @@
+import contextlib
+import io
+import json
+import os
+import socket
+import socketserver
+import sys
+import time
+import traceback
+
+root_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+for tool_dir in ("Assembler", "VMTranslator", "Compiler"):
+    sys.path.insert(0, os.path.join(root_dir, tool_dir))
+from assembler import Assembler, Coder
+from VMTranslator_08 import CODER_OPTIONS, VMTranslator
+from lexer import Lexer
+from parser import Parser as JackParser
+
+
+# Protocol: one JSON object per line in each direction
+#   request:  {"jobs": [{"op": "assemble", "path": "Prog.asm", "rom": false},
+#                       {"op": "translate", "path": "ProgDir", "optimize": true, "tos_cache": true},
+#                       {"op": "compile", "path": "Main.jack", "output": "Main.xml"}]}
+#   response: {"results": [{"ok": true, "output": "Prog.hack", "seconds": 0.001}, ...]}
+# A failed job gets {"ok": false, "error": message} and does not stop the
+# rest of its batch. {"op": "shutdown"} stops the daemon once the other
+# jobs of its batch have run; every job gets one result, in order
+# Jobs run one at a time: the VM translator reports progress on stdout,
+# which is silenced per job and is process wide
+
+
+class Toolchain:
+
+    # Tools kept loaded between jobs; importing the modules builds the
+    # lexer DFA and mnemonic tables once, and one Coder is shared by every
+    # assembly since its tables never change
+
+    def __init__(self):
+        self.coder = Coder()
+        self.jobs = 0
+
+    def assemble(self, job):
+        asm = Assembler(job["path"], coder=self.coder)
+        asm.assemble(rom=job.get("rom", False), debug=job.get("debug", False),
+                     optimize=job.get("optimize", False))
+        return asm.rom_file if job.get("rom", False) else asm.hack_file
+
+    def translate(self, job):
+        # Coder modes and the optimizer pass are chosen per job
+        options = {option: True for option in CODER_OPTIONS if job.get(option, False)}
+        translator = VMTranslator(job["path"], optimize=job.get("optimize", False), **options)
+        translator.translate()
+        translator.coder.close()
+        return translator.asm_file
+
+    def compile(self, job):
+        # Syntax analysis of a .jack file into its XML parse tree
+        output_file = job.get("output", os.path.splitext(job["path"])[0] + ".xml")
+        lexer = Lexer(job["path"])
+        parser = JackParser(lexer, output_file)
+        try:
+            parser.parse()
+        finally:
+            parser.ast.file_handle.close()
+            lexer.file_handle.close()
+        return output_file
+
+    def run(self, job):
+        # Result of one job
+        start = time.perf_counter()
+        operations = {"assemble": self.assemble, "translate": self.translate, "compile": self.compile}
+        try:
+            operation = operations[job["op"]]
+            with contextlib.redirect_stdout(io.StringIO()):
+                output = operation(job)
+        except Exception as error:
+            return {"ok": False, "error": "{}: {}".format(type(error).__name__, error),
+                    "traceback": traceback.format_exc()}
+        self.jobs += 1
+        return {"ok": True, "output": output, "seconds": time.perf_counter() - start}
+
+
+class ToolchainHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            try:
+                jobs = json.loads(line)["jobs"]
+            except (ValueError, KeyError, TypeError) as error:
+                self.reply({"error": "Bad request: {}".format(error)})
+                continue
+            # A shutdown job still lets the rest of its batch run first
+            shutdown = any(job.get("op") == "shutdown" for job in jobs)
+            self.reply({"results": [{"ok": True} if job.get("op") == "shutdown" else self.server.toolchain.run(job)
+                                    for job in jobs]})
+            if shutdown:
+                self.server.shutdown_requested = True
+                return
+
+    def reply(self, message):
+        self.wfile.write(json.dumps(message).encode() + b"\n")
+        self.wfile.flush()
+
+
+class ToolchainServer(socketserver.UnixStreamServer):
+
+    def __init__(self, socket_path):
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        socketserver.UnixStreamServer.__init__(self, socket_path, ToolchainHandler)
+        self.socket_path = socket_path
+        self.toolchain = Toolchain()
+        self.shutdown_requested = False
+
+    def serve(self):
+        # Handle connections until a shutdown job arrives
+        try:
+            while not self.shutdown_requested:
+                self.handle_request()
+        finally:
+            self.server_close()
+            os.unlink(self.socket_path)
+
+
+class ToolchainClient:
+
+    # Connection to a running daemon; each submit sends one batch
+
+    def __init__(self, socket_path):
+        self.connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.connection.connect(socket_path)
+        self.reader = self.connection.makefile("rb")
+
+    def __del__(self):
+        self.close()
+
+    def close(self):
+        self.reader.close()
+        self.connection.close()
+
+    def submit(self, jobs):
+        # Results of a batch of jobs, in order
+        for job in jobs:
+            if "path" in job:
+                job["path"] = os.path.abspath(job["path"])
+        self.connection.sendall(json.dumps({"jobs": jobs}).encode() + b"\n")
+        response = json.loads(self.reader.readline())
+        if "error" in response:
+            raise RuntimeError(response["error"])
+        return response["results"]
+
+
+if __name__ == '__main__':
+    # daemon.py serve socket
+    # daemon.py (assemble | translate | compile) socket path ...
+    # daemon.py shutdown socket
+    assert(len(sys.argv) >= 3)
+    command, socket_path = sys.argv[1], sys.argv[2]
+    if command == "serve":
+        ToolchainServer(socket_path).serve()
+    elif command == "shutdown":
+        ToolchainClient(socket_path).submit([{"op": "shutdown"}])
+    else:
+        assert(command in ("assemble", "translate", "compile"))
+        results = ToolchainClient(socket_path).submit([{"op": command, "path": path} for path in sys.argv[3:]])
+        failed = 0
+        for path, result in zip(sys.argv[3:], results):
+            if result["ok"]:
+                print("{} -> {}".format(path, result["output"]))
+            else:
+                print("{}: {}".format(path, result["error"]))
+                failed += 1
+        sys.exit(1 if failed else 0)
@@ -14,56 +14,74 @@ C_IF = 5
 C_FUNCTION = 6
 C_RETURN = 7
 C_CALL = 8
+# Produced by VMOptimizer: copy one segment entry to another
+C_MOVE = 9
+# Produced by VMOptimizer: compare the top two entries and jump to a label
+C_IF_COMPARE = 10
+
+# Coder code generation modes, each enabled by --mode-name on the command line
+CODER_OPTIONS = ("trampolines", "shared_compares", "tos_cache", "symbolic_sp", "direct_addressing")
 
 
 class VMTranslator:
 
-    def __init__(self, path):
+    def __init__(self, path, optimize=False, **options):
+        # With optimize=True the commands of each file go through
+        # VMOptimizer first; options select Coder code generation modes
         self.vm_files = self.get_vm_files(path)
         self.parsers = [Parser(vm_file) for vm_file in self.vm_files]
         self.asm_file = self.get_asm_name(path)
-        self.coder = Coder(self.asm_file)
+        self.coder = Coder(self.asm_file, **options)
+        self.optimizer = VMOptimizer() if optimize else None
+        # [commands, instructions] generated for each (push or pop, segment)
+        self.segment_words = {}
 
     def translate(self):
-        # Translate each vm command until each parser exhausted
+        # Translate the commands of each file in turn
         for parser in self.parsers:
             self.coder.set_file_name(parser.get_file_name())
             parser.preprocess()
-            while parser.hasMoreCommands():
-                parser.advance()
-                cmd_type = parser.commandType()
-                if cmd_type == C_ARITHMETIC:
-                    cmd = parser.arg1()
-                    self.coder.writeArithmetic(cmd)
-                elif cmd_type == C_PUSH:
-                    segment = parser.arg1()
-                    index = parser.arg2()
-                    self.coder.writePush(segment, index)
-                elif cmd_type == C_POP:
-                    segment = parser.arg1()
-                    index = parser.arg2()
-                    self.coder.writePop(segment, index)
-                elif cmd_type == C_LABEL:
-                    label = parser.arg1()
-                    self.coder.writeLabel(label)
-                elif cmd_type == C_GOTO:
-                    label = parser.arg1()
-                    self.coder.writeGoto(label)
-                elif cmd_type == C_IF:
-                    label = parser.arg1()
-                    self.coder.writeIf(label)
-                elif cmd_type == C_FUNCTION:
-                    name = parser.arg1()
-                    num_locals = int(parser.arg2())
-                    self.coder.writeFunction(name, num_locals)
-                elif cmd_type == C_CALL:
-                    name = parser.arg1()
-                    num_args = int(parser.arg2())
-                    self.coder.writeCall(name, num_args)
-                elif cmd_type == C_RETURN:
-                    self.coder.writeReturn()
-                else:
-                    raise RuntimeError("Invalid command type {}".format(cmd))
+            commands = parser.commands()
+            if self.optimizer is not None:
+                commands = self.optimizer.optimize(commands)
+            for command in commands:
+                self.write_command(command)
+
+    def write_command(self, command):
+        cmd_type, arg1, arg2 = command
+        if cmd_type == C_ARITHMETIC:
+            self.coder.writeArithmetic(arg1)
+        elif cmd_type == C_PUSH:
+            start = self.coder.instructions
+            self.coder.writePush(arg1, arg2)
+            self.count_segment("push", arg1, start)
+        elif cmd_type == C_POP:
+            start = self.coder.instructions
+            self.coder.writePop(arg1, arg2)
+            self.count_segment("pop", arg1, start)
+        elif cmd_type == C_MOVE:
+            self.coder.writeMove(arg1, arg2)
+        elif cmd_type == C_LABEL:
+            self.coder.writeLabel(arg1)
+        elif cmd_type == C_GOTO:
+            self.coder.writeGoto(arg1)
+        elif cmd_type == C_IF:
+            self.coder.writeIf(arg1)
+        elif cmd_type == C_IF_COMPARE:
+            self.coder.writeIfCompare(arg1, arg2)
+        elif cmd_type == C_FUNCTION:
+            self.coder.writeFunction(arg1, int(arg2))
+        elif cmd_type == C_CALL:
+            self.coder.writeCall(arg1, int(arg2))
+        elif cmd_type == C_RETURN:
+            self.coder.writeReturn()
+        else:
+            raise RuntimeError("Invalid command type {}".format(cmd_type))
+
+    def count_segment(self, cmd, segment, start):
+        counts = self.segment_words.setdefault((cmd, segment), [0, 0])
+        counts[0] += 1
+        counts[1] += self.coder.instructions - start
 
     @staticmethod
     def get_vm_files(path):
@@ -164,6 +182,19 @@ class Parser:
         cmd = self.tokenizeCommand()
         return cmd[2]
 
+    def commands(self):
+        # All commands as (type, arg1, arg2) tuples, with None for absent
+        # arguments
+        commands = []
+        self.reset()
+        while self.hasMoreCommands():
+            self.advance()
+            cmd_type = self.commandType()
+            arg1 = self.arg1() if cmd_type != C_RETURN else None
+            arg2 = self.arg2() if cmd_type in (C_PUSH, C_POP, C_FUNCTION, C_CALL) else None
+            commands.append((cmd_type, arg1, arg2))
+        return commands
+
     def preprocess(self):
         # Remove comments and whitespace
         new_lines = []
@@ -197,10 +228,174 @@ class Parser:
         return line.strip()
 
 
+class VMOptimizer:
+
+    # Rewrites the command list of a file before code generation. Rules
+    # only match runs of push, pop and arithmetic commands, so nothing is
+    # moved across a label, jump, call, function or return
+    #
+    # Rules:
+    #   fold     push constant a; push constant b; op  ->  constant result,
+    #            with negative results as push constant n; neg
+    #   identity x + 0, x - 0, x | 0, not; not and neg; neg  ->  x
+    #   move     push X; pop Y  ->  move X to Y without the stack, or
+    #            nothing when X is Y
+    #   branch   eq | gt | lt [not]; if-goto L  ->  one jump to L on the
+    #            sign of x - y, with the opposite condition after not
+
+    # Jump taken by if-goto after each comparison, and after its not
+    BRANCH_JUMPS = {"eq": ("JEQ", "JNE"), "gt": ("JGT", "JLE"), "lt": ("JLT", "JGE")}
+
+    def __init__(self):
+        self.removed = {}
+
+    def optimize(self, commands):
+        # Optimized copy of a command list; the number of commands removed
+        # is added up per function in self.removed
+        out = []
+        function = None
+        for command in commands:
+            if command[0] == C_FUNCTION:
+                function = command[1]
+            before = len(out)
+            out.append(command)
+            while self.rewrite(out):
+                pass
+            saved = before + 1 - len(out)
+            if saved:
+                self.removed[function] = self.removed.get(function, 0) + saved
+        return out
+
+    def rewrite(self, out):
+        # Apply one rule to the end of out, returning whether one applied
+        command = out[-1]
+        cmd_type, arg1, arg2 = command
+        if cmd_type == C_ARITHMETIC:
+            if arg1 in ("not", "neg") and len(out) >= 2 and out[-2] == command:
+                del out[-2:]
+                return True
+            right = self.constantAt(out, len(out) - 1)
+            if right is None:
+                return False
+            right_value, right_length = right
+            if arg1 in ("add", "sub", "or") and right_value == 0:
+                del out[-1 - right_length:]
+                return True
+            if arg1 in ("neg", "not"):
+                # Only when shorter, which keeps push constant n; neg as
+                # the form of negative constants
+                folded = self.constant(-right_value if arg1 == "neg" else ~right_value)
+                if len(folded) > right_length:
+                    return False
+                del out[-1 - right_length:]
+                out.extend(folded)
+                return True
+            left = self.constantAt(out, len(out) - 1 - right_length)
+            if left is None:
+                return False
+            left_value, left_length = left
+            value = self.fold(arg1, left_value, right_value)
+            del out[-1 - right_length - left_length:]
+            out.extend(self.constant(value))
+            return True
+        if cmd_type == C_POP and len(out) >= 2 and out[-2][0] == C_PUSH:
+            source = out[-2][1:]
+            del out[-2:]
+            if source != (arg1, arg2):
+                out.append((C_MOVE, source, (arg1, arg2)))
+            return True
+        if cmd_type == C_IF:
+            negated = len(out) >= 3 and out[-2] == (C_ARITHMETIC, "not", None)
+            compare = out[-3] if negated else out[-2] if len(out) >= 2 else None
+            if compare is None or compare[0] != C_ARITHMETIC or compare[1] not in self.BRANCH_JUMPS:
+                return False
+            jump = self.BRANCH_JUMPS[compare[1]][negated]
+            del out[-3 if negated else -2:]
+            out.append((C_IF_COMPARE, arg1, jump))
+            return True
+        return False
+
+    @staticmethod
+    def constantAt(out, end):
+        # (value, commands) of a constant pushed by the commands ending
+        # just before out[end], or None
+        if end >= 2 and out[end - 1] == (C_ARITHMETIC, "neg", None) and \
+           out[end - 2][:2] == (C_PUSH, "constant"):
+            return -int(out[end - 2][2]), 2
+        if end >= 1 and out[end - 1][:2] == (C_PUSH, "constant"):
+            return int(out[end - 1][2]), 1
+        return None
+
+    @staticmethod
+    def fold(op, x, y):
+        # 16 bit result of a binary VM operation, as a signed value
+        # Comparisons test the sign of x - y, as the generated code does
+        difference = (x - y) & 0xFFFF
+        if op == "add":
+            value = x + y
+        elif op == "sub":
+            value = difference
+        elif op == "and":
+            value = x & y
+        elif op == "or":
+            value = x | y
+        elif op == "eq":
+            value = -1 if difference == 0 else 0
+        elif op == "gt":
+            value = -1 if 0 < difference < 0x8000 else 0
+        else:
+            value = -1 if difference >= 0x8000 else 0
+        value &= 0xFFFF
+        return value - 0x10000 if value & 0x8000 else value
+
+    @staticmethod
+    def constant(value):
+        # Commands pushing a signed 16 bit value
+        value &= 0xFFFF
+        if value < 0x8000:
+            return [(C_PUSH, "constant", str(value))]
+        if value == 0x8000:
+            # -32768 has no positive counterpart
+            return [(C_PUSH, "constant", "32767"), (C_ARITHMETIC, "not", None)]
+        return [(C_PUSH, "constant", str(0x10000 - value)), (C_ARITHMETIC, "neg", None)]
+
+
 class Coder:
 
-    def __init__(self, output_file):
+    # Label names of the shared routines; they contain no '.', so they
+    # cannot clash with Jack function names or the labels inside them
+    CALL_ROUTINE = "__VM_CALL"
+    RETURN_ROUTINE = "__VM_RETURN"
+    COMPARE_ROUTINES = {"eq": "__VM_EQ", "gt": "__VM_GT", "lt": "__VM_LT"}
+    # Largest symbolic SP offset before it is written back to RAM
+    MAX_SP_OFFSET = 3
+    BASE_POINTERS = {"local": "LCL", "argument": "ARG", "this": "THIS", "that": "THAT"}
+
+    def __init__(self, output_file, trampolines=False, shared_compares=False, tos_cache=False,
+                 symbolic_sp=False, direct_addressing=False):
+        # With trampolines=True every call and return jumps to one shared
+        # routine instead of inlining the frame handling
+        # With shared_compares=True eq, gt and lt jump to one shared
+        # routine each instead of inlining a label diamond
+        # With tos_cache=True the top of the stack is kept in D between
+        # commands and only written to RAM at labels, jumps, calls and
+        # returns; while tos_cached is set, SP does not count it
+        # With symbolic_sp=True the stack pointer is RAM[SP] + sp_offset,
+        # where sp_offset is tracked at translation time and written back
+        # at labels, jumps, calls and returns
+        # With direct_addressing=True static, temp and pointer entries and
+        # entries 0 and 1 of the other segments are addressed without R13,
+        # and push constant 0 or 1 stores the value directly
         self.output_file = output_file
+        self.trampolines = trampolines
+        self.shared_compares = shared_compares
+        self.tos_cache = tos_cache
+        self.tos_cached = False
+        self.symbolic_sp = symbolic_sp
+        self.sp_offset = 0
+        self.direct_addressing = direct_addressing
+        self.file_words = {}
+        self.instructions = 0
         self.file_handle = open(output_file, 'wt')
         self.binary_ops = ("add", "sub", "and", "or")
         self.comparison_ops = ("eq", "gt", "lt")
@@ -211,10 +406,14 @@ class Coder:
         self.setup()
 
     def __del__(self):
+        self.close()
+
+    def close(self):
         self.file_handle.close()
 
     def set_file_name(self, name):
         self.current_file = name
+        self.file_words.setdefault(name, 0)
 
     def setup(self):
         # Bootstrap code
@@ -222,10 +421,19 @@ class Coder:
         # it's technically redundant and wastes 5 stack spaces
         self.writeValue2Address("SP", 256)
         self.writeCall("Sys.init", num_args=0)
+        if self.trampolines:
+            self.writeCallRoutine()
+            self.writeReturnRoutine()
+        if self.shared_compares:
+            self.writeComparisonRoutines()
     
     def write(self, string):
-        # Write command to file
+        # Write command to file, counting instructions per .vm file
         self.file_handle.write(string + "\n")
+        if not string.startswith("("):
+            self.instructions += 1
+            if self.current_file is not None:
+                self.file_words[self.current_file] += 1
 
     # Basic coding functions
 
@@ -239,14 +447,47 @@ class Coder:
 
     def incrementSP(self):
         # Increments the stack pointer
+        if self.symbolic_sp:
+            self.moveSP(1)
+            return
         self.writeAinst("SP")
         self.write("M=M+1")
 
     def decrementSP(self):
         # Decrements the stack pointer
+        if self.symbolic_sp:
+            self.moveSP(-1)
+            return
         self.writeAinst("SP")
         self.write("M=M-1")
 
+    def moveSP(self, delta):
+        # Adjust the symbolic stack pointer, writing it back before stack
+        # addresses need long A=A+1 chains
+        self.sp_offset += delta
+        if abs(self.sp_offset) > self.MAX_SP_OFFSET:
+            self.writeCommitSP()
+
+    def writeCommitSP(self):
+        # Write the symbolic SP offset back to RAM[SP], leaving D intact
+        if self.sp_offset:
+            self.writeAinst("SP")
+            for _ in range(abs(self.sp_offset)):
+                self.write("M=M+1" if self.sp_offset > 0 else "M=M-1")
+            self.sp_offset = 0
+
+    def writeStackAddress(self):
+        # Load the current stack pointer, RAM[SP] + sp_offset, into A
+        self.writeAinst("SP")
+        offset = self.sp_offset
+        if offset == 0:
+            self.write("A=M")
+            return
+        step = "+1" if offset > 0 else "-1"
+        self.write("A=M" + step)
+        for _ in range(abs(offset) - 1):
+            self.write("A=A" + step)
+
     def writeLoadAddress2D(self, address):
         self.writeAinst(address)
         self.write("D=A")
@@ -265,13 +506,20 @@ class Coder:
 
     def writeLoadPointerAddress(self, pointer, register):
         # Loads the value (address pointed to) of the pointer into register
+        if pointer == "SP" and self.symbolic_sp:
+            assert(register == "A")
+            self.writeStackAddress()
+            return
         self.writeAinst(pointer)
         self.write(register + "=M")
 
     def writeLoadPointerAddressValue(self, pointer, register):
         # Loads the value of the address pointed to by the pointer into register
-        self.writeAinst(pointer)
-        self.write("A=M")
+        if pointer == "SP" and self.symbolic_sp:
+            self.writeStackAddress()
+        else:
+            self.writeAinst(pointer)
+            self.write("A=M")
         self.write(register + "=M")
         
     def writeValue2Pointer(self, pointer, value):
@@ -309,6 +557,63 @@ class Coder:
             self.writeAinst("R13")
             self.write("M=D+M")
 
+    def writeFlushTOS(self):
+        # Push a cached top of stack to RAM
+        if self.tos_cached:
+            if self.symbolic_sp:
+                self.writeD2Pointer("SP")
+                self.incrementSP()
+            else:
+                self.writeAinst("SP")
+                self.write("AM=M+1")
+                self.write("A=A-1")
+                self.write("M=D")
+            self.tos_cached = False
+
+    def writeLoadTOS(self):
+        # Make sure the top of stack is cached in D
+        if not self.tos_cached:
+            self.writePopAddress()
+            self.write("D=M")
+            self.tos_cached = True
+
+    def writePopAddress(self):
+        # Pop the stack, leaving the address of the popped entry in A
+        if self.symbolic_sp:
+            self.decrementSP()
+            self.writeStackAddress()
+        else:
+            self.writeAinst("SP")
+            self.write("AM=M-1")
+
+    def writeBlockExit(self):
+        # Put the stack in RAM before control leaves a basic block
+        self.writeFlushTOS()
+        self.writeCommitSP()
+
+    def writeDirectAddress(self, segment, index):
+        # Load the fixed RAM address of a static, temp or pointer entry
+        if segment == "static":
+            self.writeAinst(self.current_file + "." + str(index))
+        elif segment == "temp":
+            self.writeAinst(str(5 + int(index)))
+        else:
+            self.writeAinst(str(3 + int(index)))
+
+    def writeFastAddress(self, segment, index):
+        # Load the address of a segment entry into A without R13 or D,
+        # returning False when direct addressing does not apply
+        if not self.direct_addressing:
+            return False
+        if segment in ("static", "temp", "pointer"):
+            self.writeDirectAddress(segment, index)
+            return True
+        if segment in self.BASE_POINTERS and index in ("0", "1"):
+            self.writeAinst(self.BASE_POINTERS[segment])
+            self.write("A=M" if index == "0" else "A=M+1")
+            return True
+        return False
+
     # High level coding methods
 
     def writeBinaryOp(self, cmd):
@@ -329,6 +634,16 @@ class Coder:
         self.incrementSP()
 
     def writeComparisonOp(self, cmd):
+        if self.shared_compares:
+            # Pass the return address in D to the shared routine
+            return_address = "compare_" + str(self.label_id)
+            self.label_id += 1
+            self.writeCommitSP()
+            self.writeLoadAddress2D(return_address)
+            self.writeAinst(self.COMPARE_ROUTINES[cmd])
+            self.write("0;JMP")
+            self.writeLinst(return_address)
+            return
         # Set D = M - D = x - y
         self.decrementSP()
         self.writeLoadPointerAddressValue("SP", "D")
@@ -364,6 +679,41 @@ class Coder:
         self.label_id += 1
         self.incrementSP()
 
+    def writeComparisonRoutines(self):
+        # Shared bodies of eq, gt and lt: save the return address in D to
+        # R15, pop y and x, push -1 or 0 for x - y and return
+        end_label = "__VM_COMPARE_END"
+        for cmd, jump in (("eq", "JEQ"), ("gt", "JGT"), ("lt", "JLT")):
+            routine = self.COMPARE_ROUTINES[cmd]
+            self.writeLinst(routine)
+            # Callers write SP back before jumping here
+            self.sp_offset = 0
+            self.writeAinst("R15")
+            self.write("M=D")
+            self.decrementSP()
+            self.writeLoadPointerAddressValue("SP", "D")
+            self.decrementSP()
+            self.writeLoadPointerAddress("SP", "A")
+            self.write("D=M-D")
+            self.writeAinst(routine + "_TRUE")
+            self.write("D;" + jump)
+            self.writeLoadPointerAddress("SP", "A")
+            self.write("M=0")
+            self.writeAinst(end_label)
+            self.write("0;JMP")
+            self.writeLinst(routine + "_TRUE")
+            self.writeLoadPointerAddress("SP", "A")
+            self.write("M=-1")
+            if cmd != "lt":
+                self.writeAinst(end_label)
+                self.write("0;JMP")
+        # lt falls through into the shared ending
+        self.writeLinst(end_label)
+        self.incrementSP()
+        self.writeCommitSP()
+        self.writeLoadPointerAddress("R15", "A")
+        self.write("0;JMP")
+
     def writeUnaryOp(self, cmd):
         # Load address of y into A register
         self.decrementSP()
@@ -375,18 +725,101 @@ class Coder:
             self.write("M=!M")
         self.incrementSP()
 
+    def writeArithmeticTOS(self, cmd):
+        # y is in D; x is popped from RAM and the result stays in D
+        if cmd in self.comparison_ops and self.shared_compares:
+            self.writeBlockExit()
+            self.writeComparisonOp(cmd)
+            return
+        self.writeLoadTOS()
+        if cmd in self.unary_ops:
+            self.write("D=-D" if cmd == "neg" else "D=!D")
+            return
+        self.writePopAddress()
+        if cmd == "add":
+            self.write("D=D+M")
+        elif cmd == "sub":
+            self.write("D=M-D")
+        elif cmd == "and":
+            self.write("D=D&M")
+        elif cmd == "or":
+            self.write("D=D|M")
+        else:
+            true_label = "true_" + str(self.label_id)
+            end_label = "end_" + str(self.label_id)
+            self.label_id += 1
+            self.write("D=M-D")
+            self.writeAinst(true_label)
+            self.write("D;" + {"eq": "JEQ", "gt": "JGT", "lt": "JLT"}[cmd])
+            self.write("D=0")
+            self.writeAinst(end_label)
+            self.write("0;JMP")
+            self.writeLinst(true_label)
+            self.write("D=-1")
+            self.writeLinst(end_label)
+
     def writeArithmetic(self, cmd):
-        if cmd in self.binary_ops:
+        if self.tos_cache:
+            self.writeArithmeticTOS(cmd)
+        elif cmd in self.binary_ops:
             self.writeBinaryOp(cmd)
         elif cmd in self.comparison_ops:
             self.writeComparisonOp(cmd)
         elif cmd in self.unary_ops:
             self.writeUnaryOp(cmd)   
 
+    def writeLoadSegment2D(self, segment, index):
+        # Load a segment entry (or constant) into D
+        if segment == "constant" and self.direct_addressing and index in ("0", "1"):
+            self.write("D=" + index)
+        elif segment == "constant":
+            self.writeLoadAddress2D(str(index))
+        elif self.writeFastAddress(segment, index):
+            self.write("D=M")
+        else:
+            self.writeR13OffsetAddress(segment, index)
+            self.writeLoadPointerAddressValue("R13", "D")
+
+    def writeD2Segment(self, segment, index):
+        # Store D into a segment entry
+        if segment in ("static", "temp", "pointer"):
+            self.writeDirectAddress(segment, index)
+            self.write("M=D")
+        elif self.writeFastAddress(segment, index):
+            self.write("M=D")
+        else:
+            # Keep the value in R14 while the target address is computed
+            self.writeAinst("R14")
+            self.write("M=D")
+            self.writeR13OffsetAddress(segment, index)
+            self.writeLoadPointerAddress("R14", "D")
+            self.writeD2Pointer("R13")
+
+    def writePushTOS(self, segment, index):
+        # Load the pushed value into D, after flushing the previous top
+        self.writeFlushTOS()
+        self.writeLoadSegment2D(segment, index)
+        self.tos_cached = True
+
+    def writePopTOS(self, segment, index):
+        # Store the top of stack from D
+        self.writeLoadTOS()
+        self.tos_cached = False
+        self.writeD2Segment(segment, index)
+
     def writePush(self, segment, index):
         # Push the value in the segment index onto the stack
-        if segment == "constant":
+        if self.tos_cache:
+            self.writePushTOS(segment, index)
+            return
+        if segment == "constant" and self.direct_addressing and index in ("0", "1"):
+            self.writeLoadPointerAddress("SP", "A")
+            self.write("M=" + index)
+        elif segment == "constant":
             self.writeValue2Pointer("SP", index)
+        elif self.writeFastAddress(segment, index):
+            self.write("D=M")
+            self.writeD2Pointer("SP")
         else:
             # Set target address in R13 register
             self.writeR13OffsetAddress(segment, index)
@@ -399,6 +832,15 @@ class Coder:
 
     def writePop(self, segment, index):
         # Pop top element of stack into given segment index
+        if self.tos_cache:
+            self.writePopTOS(segment, index)
+            return
+        if self.direct_addressing and (segment in ("static", "temp", "pointer") or index in ("0", "1")):
+            self.decrementSP()
+            self.writeLoadPointerAddressValue("SP", "D")
+            self.writeFastAddress(segment, index)
+            self.write("M=D")
+            return
         # Set target address in R13 register
         self.writeR13OffsetAddress(segment, index)
         # Pop the top value of stack into D register
@@ -407,25 +849,53 @@ class Coder:
         # Assign D register to R13's target address
         self.writeD2Pointer("R13")
 
+    def writeMove(self, source, target):
+        # Copy a segment entry (or constant) to another without the stack
+        self.writeFlushTOS()
+        self.writeLoadSegment2D(*source)
+        self.writeD2Segment(*target)
+
     def writeLabel(self, label):
         # Write label
+        self.writeBlockExit()
         self.writeLinst(self.current_function + "$" + label)
 
     def writeGoto(self, label):
         # Go to label
+        self.writeBlockExit()
         self.writeAinst(self.current_function + "$" + label)
         self.write("0;JMP")
 
     def writeIf(self, label):
         # If top value of stack =/= 0, jump to label
-        self.decrementSP()
-        self.writeLoadPointerAddressValue("SP", "D")
+        if self.tos_cache:
+            self.writeLoadTOS()
+            self.tos_cached = False
+        else:
+            self.decrementSP()
+            self.writeLoadPointerAddressValue("SP", "D")
+        self.writeCommitSP()
         self.writeAinst(self.current_function + "$" + label)
         self.write("D;JNE")
 
+    def writeIfCompare(self, label, jump):
+        # Pop y and x and jump to label on x - y, without pushing a result
+        if self.tos_cache:
+            self.writeLoadTOS()
+            self.tos_cached = False
+        else:
+            self.decrementSP()
+            self.writeLoadPointerAddressValue("SP", "D")
+        self.writePopAddress()
+        self.write("D=M-D")
+        self.writeCommitSP()
+        self.writeAinst(self.current_function + "$" + label)
+        self.write("D;" + jump)
+
     def writeFunction(self, function_name, num_locals):
         # Declare a function
         print("Compiling function {}".format(function_name))
+        self.writeBlockExit()
         self.current_function = function_name
         self.writeLinst(function_name) # Names are already unique from compilation
         for _ in range(num_locals):
@@ -442,6 +912,17 @@ class Coder:
         # Create unique return address and push onto stack
         return_address = function_name + "_" + str(self.label_id)
         self.label_id += 1
+        self.writeBlockExit()
+        if self.trampolines:
+            # Pass the function in R13, the argument count in R14 and the
+            # return address in D to the shared call routine
+            self.writeValue2Address("R13", function_name)
+            self.writeValue2Address("R14", num_args)
+            self.writeLoadAddress2D(return_address)
+            self.writeAinst(self.CALL_ROUTINE)
+            self.write("0;JMP")
+            self.writeLinst(return_address)
+            return
         self.writeAinst(return_address)
         self.write("D=A")
         self.writeD2Pointer("SP")
@@ -451,6 +932,7 @@ class Coder:
         self.writePushRegister("ARG")
         self.writePushRegister("THIS")
         self.writePushRegister("THAT")
+        self.writeCommitSP()
         # Reposition ARG = SP - n - 5 and LCL = SP
         self.writeAinst("SP")
         self.write("D=M")
@@ -469,6 +951,38 @@ class Coder:
         self.write("0;JMP")
         self.writeLinst(return_address)
 
+    def writeCallRoutine(self):
+        # Shared body of every call: push the return address in D and the
+        # caller's frame, reposition ARG = SP - R14 - 5 and LCL = SP, then
+        # jump to the function in R13
+        self.writeLinst(self.CALL_ROUTINE)
+        self.writeD2Pointer("SP")
+        self.incrementSP()
+        self.writePushRegister("LCL")
+        self.writePushRegister("ARG")
+        self.writePushRegister("THIS")
+        self.writePushRegister("THAT")
+        self.writeCommitSP()
+        self.writeAinst("R14")
+        self.write("D=M")
+        self.writeAinst("5")
+        self.write("D=D+A")
+        self.writeAinst("SP")
+        self.write("D=M-D")
+        self.writeAinst("ARG")
+        self.write("M=D")
+        self.writeAinst("SP")
+        self.write("D=M")
+        self.writeAinst("LCL")
+        self.write("M=D")
+        self.writeLoadPointerAddress("R13", "A")
+        self.write("0;JMP")
+
+    def writeReturnRoutine(self):
+        # Shared body of every return; return sites carry no state
+        self.writeLinst(self.RETURN_ROUTINE)
+        self.writeReturnBody()
+
     def writeR14OffsetCallVariables(self, offset, target):
         self.writeAinst("R14")
         self.write("D=M")   # D = *R14 = FRAME
@@ -479,6 +993,15 @@ class Coder:
         self.write("M=D")
 
     def writeReturn(self):
+        # Return from function
+        self.writeBlockExit()
+        if self.trampolines:
+            self.writeAinst(self.RETURN_ROUTINE)
+            self.write("0;JMP")
+        else:
+            self.writeReturnBody()
+
+    def writeReturnBody(self):
         # Virtual register R13 is already used for pop operations
         # Save LCL to virtual register 14 (FRAME)
         self.writeAinst("LCL")
@@ -495,6 +1018,7 @@ class Coder:
         self.writeLoadPointerAddress("ARG", "D")
         self.writeAinst("SP")
         self.write("M=D+1")
+        self.sp_offset = 0
         # Restore caller's THAT, THIS, ARG, and LCL pointers
         self.writeR14OffsetCallVariables(1, "THAT")
         self.writeR14OffsetCallVariables(2, "THIS")
@@ -507,7 +1031,16 @@ class Coder:
 
 
 if __name__ == '__main__':
-    assert(len(sys.argv)==2)
+    # VMTranslator_08.py path [--trampolines] [--shared-compares] [--tos-cache]
+    #                        [--symbolic-sp] [--direct-addressing] [--optimize]
+    assert(len(sys.argv) >= 2)
     vm_file = sys.argv[1]
-    translator = VMTranslator(vm_file)
+    options = {flag[2:].replace("-", "_"): True for flag in sys.argv[2:]}
+    assert(all(option in CODER_OPTIONS + ("optimize",) for option in options))
+    translator = VMTranslator(vm_file, **options)
     translator.translate()
+    for file_name, words in translator.coder.file_words.items():
+        print("{}: {} instructions".format(file_name, words))
+    if translator.optimizer is not None:
+        for function, removed in translator.optimizer.removed.items():
+            print("{}: {} VM commands removed".format(function, removed))
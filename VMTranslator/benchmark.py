@@ -0,0 +1,125 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+from VMTranslator_08 import VMTranslator
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Emulator"))
+from aot import *
+from assembler import Assembler
+
+
+# VMTranslator options of each translation mode
+MODES = {"baseline": {},
+         "trampolines": {"trampolines": True},
+         "shared_compares": {"shared_compares": True},
+         "tos_cache": {"tos_cache": True},
+         "symbolic_sp": {"symbolic_sp": True},
+         "direct_addressing": {"direct_addressing": True},
+         "optimize": {"optimize": True},
+         "combined": {"trampolines": True, "shared_compares": True, "tos_cache": True,
+                      "symbolic_sp": True, "direct_addressing": True, "optimize": True}}
+
+# RAM compared between modes: SP and the static segment. Temporaries,
+# saved frames and the stack above SP hold mode specific return addresses
+COMPARED_RAM = [0] + list(range(16, 256))
+
+
+def translate(vm_path, work_dir, options):
+    # Translate and assemble a copy of a .vm file or directory, returning
+    # the ROM words, the instructions generated for each .vm file and the
+    # [commands, instructions] of each push/pop segment
+    copy_path = os.path.join(work_dir, os.path.basename(os.path.normpath(vm_path)))
+    if os.path.isdir(vm_path):
+        shutil.copytree(vm_path, copy_path)
+    else:
+        shutil.copy(vm_path, copy_path)
+    translator = VMTranslator(copy_path, **options)
+    with contextlib.redirect_stdout(io.StringIO()):
+        translator.translate()
+    translator.coder.close()
+    asm = Assembler(translator.asm_file)
+    asm.assemble()
+    file_words = {os.path.basename(name): words for name, words in translator.coder.file_words.items()}
+    segment_words = {" ".join(key): counts for key, counts in translator.segment_words.items()}
+    return asm.words, file_words, segment_words
+
+
+def run_program(rom, max_cycles):
+    # Cycles to halt and the compared RAM words
+    emulator = BlockEmulator(rom)
+    cycles = emulator.run(max_cycles)
+    return cycles, emulator.halted, [emulator.RAM[address] for address in COMPARED_RAM]
+
+
+def run_benchmarks(vm_paths, modes, max_cycles, work_dir):
+    results = []
+    for vm_path in vm_paths:
+        baseline = baseline_files = None
+        segment_table = {}
+        for mode in modes:
+            mode_dir = os.path.join(work_dir, mode, str(len(results)))
+            os.makedirs(mode_dir)
+            start = time.perf_counter()
+            rom, file_words, segment_words = translate(vm_path, mode_dir, MODES[mode])
+            build_seconds = time.perf_counter() - start
+            cycles, halted, RAM = run_program(rom, max_cycles)
+            if baseline is None:
+                baseline, baseline_files = RAM, file_words
+            results.append({"program": vm_path,
+                            "mode": mode,
+                            "rom_words": len(rom),
+                            "cycles": cycles,
+                            "halted": halted,
+                            "matches_first_mode": RAM == baseline,
+                            "build_seconds": build_seconds,
+                            "file_words": file_words,
+                            "segment_words": segment_words})
+            print("{:<24} {:<18} {:>7} words {:>12} cycles {:>7.3f}s build{}{}".format(
+                os.path.basename(os.path.normpath(vm_path)), mode, len(rom), cycles, build_seconds,
+                "" if halted else " (budget exhausted)", "" if RAM == baseline else " RESULT DIFFERS"))
+            if file_words is not baseline_files:
+                for name, words in sorted(file_words.items()):
+                    before = baseline_files.get(name, 0)
+                    print("    {:<20} {:>7} -> {:>7} words ({:+.1f}%)".format(
+                        name, before, words, 100.0 * (words - before) / before if before else 0))
+            for segment, (commands, words) in segment_words.items():
+                segment_table.setdefault(segment, {})[mode] = words / commands
+        print_segment_table(segment_table, modes)
+    return results
+
+
+def print_segment_table(segment_table, modes):
+    # Average instructions per push/pop command of each segment and mode
+    print("\n{:<18}".format("instructions/cmd") + "".join("{:>12}".format(mode[:11]) for mode in modes))
+    for segment in sorted(segment_table):
+        row = segment_table[segment]
+        print("{:<18}".format(segment) + "".join("{:>12.1f}".format(row[mode]) if mode in row else
+                                                 "{:>12}".format("-") for mode in modes))
+    print()
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description="ROM size and cycle counts of VM translation modes")
+    arg_parser.add_argument("programs", nargs="+", help=".vm files or directories")
+    arg_parser.add_argument("--modes", nargs="+", default=list(MODES), choices=list(MODES))
+    arg_parser.add_argument("--cycles", type=int, default=50000000)
+    arg_parser.add_argument("--output", default=None)
+    args = arg_parser.parse_args()
+    with tempfile.TemporaryDirectory() as work_dir:
+        results = run_benchmarks(args.programs, args.modes, args.cycles, work_dir)
+    if args.output is not None:
+        report = {"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                  "python": platform.python_version(),
+                  "platform": platform.platform(),
+                  "results": results}
+        out_file = open(args.output, "wt")
+        json.dump(report, out_file, indent=2)
+        out_file.close()